@@ -2,9 +2,12 @@
 
 import os
 from flask import Flask
-from sqlalchemy import inspect
+from werkzeug.middleware.proxy_fix import ProxyFix
 from qqueue.config import BaseConfig, DevConfig, DATABASE_DIR, SQLITE_PREFIX
-from qqueue.extensions import database, login
+from qqueue.extensions import database, login, cache, identities, fragments, configure_sqlite
+from qqueue.migrations import upgrade_database, stamp_database
+from qqueue.throttle import buckets
+from qqueue.templating import configure_templates
 
 def create_app(config:BaseConfig=DevConfig) -> Flask:
     '''Creates and returns an instance of qqueue. Order matters here.'''
@@ -13,56 +16,64 @@ def create_app(config:BaseConfig=DevConfig) -> Flask:
     app = Flask(__name__)
     app.config.from_object(config)
     if app.testing: app.logger.info('App configured for testing mode.')
+    if hops := app.config['PROXY_HOPS']: # real client address and scheme
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=hops, x_proto=1)
 
     # init extensions
     database.init_app(app=app)
     login.init_app(app=app)
+    cache.init_app(app=app)
+    identities.init_app(app=app)
+    fragments.init_app(app=app)
 
     # internal imports to avoid circular references
-    from qqueue.models import Column, User, Task                # pylint: disable=import-outside-toplevel
+    from qqueue.models import User, UserSnapshot                # pylint: disable=import-outside-toplevel
     from qqueue.routes.main import blueprint as main_routes     # pylint: disable=import-outside-toplevel
     from qqueue.routes.auth import blueprint as auth_routes     # pylint: disable=import-outside-toplevel
     from qqueue.routes.users import blueprint as user_routes    # pylint: disable=import-outside-toplevel
     from qqueue.routes.tasks import blueprint as task_routes    # pylint: disable=import-outside-toplevel
+    from qqueue.routes.api import blueprint as api_routes       # pylint: disable=import-outside-toplevel
 
     # init login
     login.login_view = 'auth.login'
+    login.blueprint_login_views['api'] = None # 401 instead of a redirect
     @login.user_loader
-    def load_user(user_id:int) -> User|None:
-        return User.query.get(int(user_id))
+    def load_user(user_id:str) -> UserSnapshot|None:
+        # the most frequent query in the app, so serve it from memory; any
+        # route that changes these columns must call `identities.delete`
+        user_id = int(user_id)
+        snapshot = identities.get(user_id)
+        if snapshot is None:
+            user = database.session.get(User, user_id)
+            if user is None: return None
+            snapshot = UserSnapshot(user)
+            identities.set(user_id, snapshot, ttl=app.config['USER_CACHE_TTL'])
+        return snapshot
 
     # register routes
     app.register_blueprint(main_routes)
     app.register_blueprint(auth_routes, url_prefix='/auth')
     app.register_blueprint(user_routes, url_prefix='/users')
     app.register_blueprint(task_routes, url_prefix='/tasks')
+    app.register_blueprint(api_routes, url_prefix='/api/v1')
+
+    # compile templates (cached on disk, optionally all up front)
+    configure_templates(app)
 
     # init database
     if SQLITE_PREFIX in config.SQLALCHEMY_DATABASE_URI:
         os.makedirs(DATABASE_DIR, exist_ok=True)
     with app.app_context():
-        rebuild_database = app.testing # Always rebuild on test
-        if not rebuild_database:
-            inspector = inspect(database.engine)
-            for table in [User, Task]: # !!! Don't forget to add new tables !!!
-                # Check that each table exists
-                if not inspector.has_table(table.__tablename__):
-                    rebuild_database = True
-                # And if it does, that all its columns are present in the model
-                if not rebuild_database:
-                    for column in inspector.get_columns(table.__tablename__):
-                        if not hasattr(table, column['name']):
-                            rebuild_database = True
-                            break
-                # If any snags are hit, stop immediately
-                else: break
-        # if (vs else) in case flag flipped during integrity check
-        if rebuild_database:
-            app.logger.log(level=(20 if app.testing else 40),
-                           msg='Rebuilding database...')
+        configure_sqlite(database.engine, app.config['SQLITE_PRAGMAS'])
+        if app.testing: # Always rebuild on test
+            app.logger.info(msg='Rebuilding database...')
             database.drop_all()
             database.create_all()
+            stamp_database()
+        else: # never drop live data; upgrade the schema in place instead
+            upgrade_database(app)
     app.logger.info('Database ready.')
+    buckets.init_app(app=app) # login throttling, outside the main database
 
     return app
 
@@ -0,0 +1,80 @@
+'''
+Blockchain (Ethereum-style) address validation without web3.
+
+Addresses are 20 bytes written as 40 hex digits with an optional `0x`. All
+lowercase or all uppercase digits are accepted as-is; mixed case is treated
+as an EIP-55 checksum and must match it. The Keccak-256 hash that EIP-55
+needs is implemented here in pure Python (after the Keccak team's
+CompactFIPS202 reference), since `hashlib.sha3_256` pads differently and
+the only other sources pull in the whole web3 stack.
+'''
+
+import re
+
+ADDRESS_PATTERN = re.compile(r'(0[xX])?[0-9a-fA-F]{40}') # used with fullmatch
+KECCAK_RATE = 136 # bytes absorbed per permutation for a 256-bit digest
+
+def rotate_left(lane:int, offset:int) -> int:
+    '''Rotates a 64-bit lane left by `offset` bits.'''
+    offset %= 64
+    return ((lane << offset) | (lane >> (64 - offset))) & 0xFFFFFFFFFFFFFFFF
+
+def keccak_f1600(lanes:list[list[int]]) -> list[list[int]]:
+    '''Applies the 24-round Keccak-f[1600] permutation to a 5x5 lane state.'''
+    lfsr = 1
+    for _ in range(24):
+        # theta
+        parity = [lanes[x][0] ^ lanes[x][1] ^ lanes[x][2] ^ lanes[x][3] ^
+                  lanes[x][4] for x in range(5)]
+        lanes = [[lanes[x][y] ^ parity[(x+4) % 5] ^
+                  rotate_left(parity[(x+1) % 5], 1) for y in range(5)]
+                 for x in range(5)]
+        # rho and pi
+        x, y = 1, 0
+        current = lanes[x][y]
+        for t in range(24):
+            x, y = y, (2*x + 3*y) % 5
+            current, lanes[x][y] = lanes[x][y], rotate_left(current, (t+1)*(t+2)//2) # pylint: disable=line-too-long
+        # chi
+        for y in range(5):
+            row = [lanes[x][y] for x in range(5)]
+            for x in range(5):
+                lanes[x][y] = row[x] ^ (~row[(x+1) % 5] & row[(x+2) % 5])
+        # iota
+        for j in range(7):
+            lfsr = ((lfsr << 1) ^ ((lfsr >> 7) * 0x71)) % 256
+            if lfsr & 2:
+                lanes[0][0] ^= 1 << ((1 << j) - 1)
+    return lanes
+
+def keccak256(data:bytes) -> bytes:
+    '''Returns the (pre-standard, Ethereum) Keccak-256 digest of `data`.'''
+    padding = KECCAK_RATE - len(data) % KECCAK_RATE
+    if padding == 1:
+        data += b'\x81'
+    else:
+        data += b'\x01' + bytes(padding - 2) + b'\x80'
+    lanes = [[0] * 5 for _ in range(5)]
+    for start in range(0, len(data), KECCAK_RATE):
+        block = data[start:start + KECCAK_RATE]
+        for i in range(KECCAK_RATE // 8):
+            lanes[i % 5][i // 5] ^= int.from_bytes(block[8*i:8*i+8], 'little')
+        lanes = keccak_f1600(lanes)
+    return b''.join(lanes[i % 5][i // 5].to_bytes(8, 'little')
+                    for i in range(4))
+
+def to_checksum_address(address:str) -> str:
+    '''Returns `address` with its EIP-55 mixed-case checksum applied.'''
+    digits = address[2:].lower() if address[:2] in ('0x', '0X') else address.lower() # pylint: disable=line-too-long
+    digest = keccak256(digits.encode('ascii')).hex()
+    return '0x' + ''.join(char.upper() if int(digest[i], 16) >= 8 else char
+                          for i, char in enumerate(digits))
+
+def is_address(address:str) -> bool:
+    '''True if `address` is a well-formed address with a valid checksum.'''
+    if not isinstance(address, str) or not ADDRESS_PATTERN.fullmatch(address):
+        return False
+    digits = address[-40:]
+    if digits in (digits.lower(), digits.upper()):
+        return True
+    return address[-40:] == to_checksum_address(address)[2:]
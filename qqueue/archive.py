@@ -0,0 +1,63 @@
+'''
+Hot/cold split for tasks.
+
+Approved tasks never change again, so `archive_tasks` moves them (and their
+comments) out of `task`/`comment` into `task_archive`/`comment_archive`,
+keeping their ids. The live tables, and every index behind the task board
+and profile pages, then only hold the working set. Rows move in chunks of
+`ARCHIVE_BATCH_SIZE`, one transaction per chunk, so the job can run against
+a live database and be stopped at any point.
+
+History read paths (task pages, exports, the API) fall back to the archive
+when a task isn't live.
+'''
+
+from datetime import datetime, timedelta
+from sqlalchemy import DateTime, delete, insert, literal, select
+from qqueue.extensions import database
+from qqueue.models import Task, Comment, ArchivedTask, ArchivedComment
+from qqueue.states import TaskStatus
+
+TASK_COLUMNS = [column.name for column in ArchivedTask.__table__.columns
+                if column.name != 'archived_at']
+COMMENT_COLUMNS = [column.name for column in ArchivedComment.__table__.columns]
+
+def archivable_ids(cutoff:datetime, limit:int) -> list[int]:
+    '''Returns up to `limit` ids of tasks approved before `cutoff`.'''
+    return database.session.execute(
+        select(Task.id)
+        .where(Task.status == TaskStatus.APPROVED, Task.approved_at < cutoff)
+        .order_by(Task.id)
+        .limit(limit)
+    ).scalars().all()
+
+def move_tasks(task_ids:list[int]) -> None:
+    '''Copies `task_ids` and their comments to the archive, then deletes them.'''
+    task, comment = Task.__table__, Comment.__table__
+    archived_at = literal(datetime.now(), DateTime(timezone=True))
+    database.session.execute(
+        insert(ArchivedTask.__table__).from_select(
+            TASK_COLUMNS + ['archived_at'],
+            select(*[task.c[name] for name in TASK_COLUMNS], archived_at)
+            .where(task.c.id.in_(task_ids))))
+    database.session.execute(
+        insert(ArchivedComment.__table__).from_select(
+            COMMENT_COLUMNS,
+            select(*[comment.c[name] for name in COMMENT_COLUMNS])
+            .where(comment.c.task_id.in_(task_ids))))
+    database.session.execute(delete(comment)
+                             .where(comment.c.task_id.in_(task_ids)))
+    database.session.execute(delete(task).where(task.c.id.in_(task_ids)))
+
+def archive_tasks(older_than:timedelta, batch_size:int) -> int:
+    '''
+    Archives every task approved more than `older_than` ago, `batch_size`
+    tasks per transaction. Returns how many tasks were moved.
+    '''
+    cutoff = datetime.now() - older_than
+    moved = 0
+    while task_ids := archivable_ids(cutoff, batch_size):
+        move_tasks(task_ids)
+        database.session.commit()
+        moved += len(task_ids)
+    return moved
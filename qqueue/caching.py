@@ -0,0 +1,182 @@
+'''
+Shared cache backends for `qqueue.extensions.Cache`.
+
+The in-process `TTLCache` (in `qqueue.extensions`) is the fastest, but each
+worker keeps its own copy. The backends here are shared by every worker:
+
+    SQLiteBackend   a small standalone SQLite file on local disk, for
+                    several workers on one host (like `qqueue.throttle`)
+    RedisBackend    any server speaking the Redis protocol, for several
+                    hosts; talks RESP over a plain socket, so no client
+                    library is needed
+
+Both store pickled values, so only point them at storage the app owns.
+Every backend offers `get(key, default)`, `set(key, value, ttl)`,
+`delete(key)` and `clear()`, and counts the entries it evicts.
+'''
+
+import os
+import pickle
+import socket
+import sqlite3
+import threading
+from time import time
+from urllib.parse import urlsplit
+
+class SQLiteBackend():
+    '''
+    Entries in a local SQLite file, shared by every worker on the host.
+    Expired entries are swept, and the oldest dropped to keep at most
+    `max_entries` in `namespace`, every `PRUNE_EVERY` sets.
+    '''
+    PRUNE_EVERY = 500 # sets between sweeps
+
+    def __init__(self, path:str, namespace:str, max_entries:int|None=None):
+        self.path = path
+        self.namespace = namespace
+        self.max_entries = max_entries
+        self.evictions = 0
+        self._local = threading.local()
+        self._sets = 0
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.connect().execute('''CREATE TABLE IF NOT EXISTS cache (
+            namespace TEXT NOT NULL, key TEXT NOT NULL, value BLOB NOT NULL,
+            expires_at REAL NOT NULL, PRIMARY KEY (namespace, key)
+        )''')
+
+    def connect(self) -> sqlite3.Connection:
+        '''Returns this thread's connection to the cache database.'''
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5,
+                                         isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+        return connection
+
+    def get(self, key, default=None):
+        '''Returns the value stored under `key`, or `default` if expired.'''
+        row = self.connect().execute(
+            'SELECT value, expires_at FROM cache WHERE namespace = ? AND key = ?', # pylint: disable=line-too-long
+            (self.namespace, repr(key))).fetchone()
+        if row is None or row[1] < time(): return default
+        return pickle.loads(row[0])
+
+    def set(self, key, value, ttl:float) -> None:
+        '''Stores `value` under `key` for `ttl` seconds.'''
+        connection = self.connect()
+        connection.execute('''
+            INSERT INTO cache (namespace, key, value, expires_at)
+            VALUES (?, ?, ?, ?) ON CONFLICT (namespace, key) DO UPDATE
+            SET value = excluded.value, expires_at = excluded.expires_at
+        ''', (self.namespace, repr(key), pickle.dumps(value), time() + ttl))
+        self._sets += 1
+        if self._sets % self.PRUNE_EVERY == 0: self.prune()
+
+    def delete(self, key) -> None:
+        '''Removes `key` from the cache, if present.'''
+        self.connect().execute(
+            'DELETE FROM cache WHERE namespace = ? AND key = ?',
+            (self.namespace, repr(key)))
+
+    def clear(self) -> None:
+        '''Removes every entry in this backend's namespace.'''
+        self.connect().execute('DELETE FROM cache WHERE namespace = ?',
+                               (self.namespace,))
+
+    def prune(self) -> None:
+        '''Drops expired entries, then the soonest to expire over the limit.'''
+        connection = self.connect()
+        removed = connection.execute(
+            'DELETE FROM cache WHERE namespace = ? AND expires_at < ?',
+            (self.namespace, time())).rowcount
+        if self.max_entries is not None:
+            removed += connection.execute('''
+                DELETE FROM cache WHERE namespace = ? AND key IN (
+                    SELECT key FROM cache WHERE namespace = ?
+                    ORDER BY expires_at DESC LIMIT -1 OFFSET ?)
+            ''', (self.namespace, self.namespace, self.max_entries)).rowcount
+        self.evictions += removed
+
+
+class RedisBackend():
+    '''
+    Entries on a Redis-protocol server, shared by every worker that points
+    at `url` (`redis://host:port/db`). Keys are prefixed with `namespace`,
+    and expiry and eviction are left to the server, so `evictions` stays 0;
+    see the server's own `INFO stats` instead.
+    '''
+    def __init__(self, url:str, namespace:str, timeout:float=1.0):
+        parts = urlsplit(url)
+        self.address = (parts.hostname or 'localhost', parts.port or 6379)
+        self.db = int(parts.path.strip('/') or 0)
+        self.namespace = namespace
+        self.timeout = timeout
+        self.evictions = 0
+        self._local = threading.local()
+
+    def connect(self):
+        '''Returns this thread's (socket, reader) pair for the server.'''
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            sock = socket.create_connection(self.address, self.timeout)
+            connection = (sock, sock.makefile('rb'))
+            self._local.connection = connection
+            if self.db: self.command('SELECT', self.db)
+        return connection
+
+    def command(self, *args):
+        '''Sends one command and returns its parsed reply.'''
+        sock, reader = self.connect()
+        request = [b'*%d\r\n' % len(args)]
+        for arg in args:
+            if not isinstance(arg, bytes): arg = str(arg).encode()
+            request.append(b'$%d\r\n%s\r\n' % (len(arg), arg))
+        try:
+            sock.sendall(b''.join(request))
+            return self.reply(reader)
+        except (OSError, ValueError) as error: # ValueError: a garbled reply
+            self._local.connection = None # reconnect on the next command
+            sock.close()
+            if isinstance(error, OSError): raise
+            raise ConnectionError(f'Bad cache server reply: {error}') from error
+
+    def reply(self, reader):
+        '''Parses one RESP reply from `reader`.'''
+        line = reader.readline()
+        if not line: raise ConnectionError('Cache server closed the connection.') # pylint: disable=line-too-long
+        kind, body = line[:1], line[1:-2]
+        match kind:
+            case b'+': return body.decode()
+            case b'-': raise RuntimeError(body.decode())
+            case b':': return int(body)
+            case b'$':
+                if int(body) < 0: return None
+                return reader.read(int(body) + 2)[:-2]
+            case b'*':
+                return [self.reply(reader) for _ in range(int(body))]
+        raise ValueError(f'Unexpected cache server reply: {line!r}')
+
+    def name(self, key) -> str:
+        '''Returns the server-side name for `key`.'''
+        return f'{self.namespace}:{key!r}'
+
+    def get(self, key, default=None):
+        '''Returns the value stored under `key`, or `default` if expired.'''
+        value = self.command('GET', self.name(key))
+        return default if value is None else pickle.loads(value)
+
+    def set(self, key, value, ttl:float) -> None:
+        '''Stores `value` under `key` for `ttl` seconds.'''
+        self.command('SET', self.name(key), pickle.dumps(value),
+                     'PX', max(int(ttl * 1000), 1))
+
+    def delete(self, key) -> None:
+        '''Removes `key` from the cache, if present.'''
+        self.command('DEL', self.name(key))
+
+    def clear(self) -> None:
+        '''Removes every entry in this backend's namespace.'''
+        names = self.command('KEYS', f'{self.namespace}:*')
+        if names: self.command('DEL', *names)
@@ -12,6 +12,53 @@ class BaseConfig(): # pylint: disable=too-few-public-methods
     SQLALCHEMY_DATABASE_URI = str()
     SQLALCHEMY_TRACK_MODIFICATIONS = False # https://stackoverflow.com/a/33790196/3178898 pylint: disable=line-too-long
     TESTING = False
+    SQLALCHEMY_ENGINE_OPTIONS = {} # passed to create_engine(), e.g. pool sizing
+    SQLITE_PRAGMAS = { # run on every new SQLite connection; ignored otherwise
+        'journal_mode': 'WAL',  # readers and the (single) writer don't block
+        'synchronous': 'NORMAL', # fsync at checkpoints only; durable with WAL
+        'busy_timeout': 5000, # ms to wait on a lock, then "database is locked"
+        'cache_size': -16000,   # negative = KiB, so ~16 MB of page cache
+        'mmap_size': 64 * 1024**2, # bytes of the file read through mmap
+    }
+    TASK_PAGE_SIZE = 20 # rows per section on the task board
+    COMMENT_PAGE_SIZE = 20 # comments per page of a task's thread
+    TASK_TEASER_TTL = 30 # seconds the logged-out task teaser is cached
+    STATIC_PAGE_TTL = 3600 # seconds a pre-rendered home/about page is kept
+    STATIC_PAGE_MAX_AGE = 300 # seconds browsers may reuse them when logged out
+    USER_PAGE_SIZE = 20 # rows per page in the user directory
+    USER_COUNT_TTL = 60 # seconds the logged-out user count is cached
+    IMPORT_BATCH_SIZE = 500 # task rows inserted per transaction on import
+    EXPORT_BATCH_SIZE = 500 # rows fetched per round-trip on export
+    ARCHIVE_AFTER_DAYS = 30 # approved tasks older than this leave `task`
+    ARCHIVE_BATCH_SIZE = 500 # tasks moved per transaction by the archiver
+    # werkzeug method string; changing it upgrades hashes on next login
+    PASSWORD_HASH_METHOD = 'scrypt:32768:8:1'
+    PASSWORD_SALT_LENGTH = 16
+    PASSWORD_HASH_WORKERS = 2 # hashing processes per web worker; 0 = inline
+    PASSWORD_HASH_QUEUE = 16 # max hashes in flight per web worker
+    PASSWORD_HASH_WAIT = 2.0 # seconds to wait for a slot before a 503
+    USER_CACHE_TTL = 300 # seconds a logged in user is served from memory
+    # cache backends: memory (per worker), sqlite (per host) or redis
+    CACHE_BACKEND = 'memory' # route-level values, e.g. the task teaser
+    CACHE_SIZE = 1024 # entries kept by the memory/sqlite backends
+    CACHE_SQLITE_PATH = os.path.join(DATABASE_DIR, 'cache.db')
+    CACHE_REDIS_URL = 'redis://localhost:6379/0'
+    IDENTITY_CACHE_BACKEND = 'memory' # hit on every request, so keep it local
+    IDENTITY_CACHE_SIZE = 4096 # logged in users kept per worker
+    FRAGMENT_CACHE_BACKEND = 'memory' # rendered task/user cards
+    FRAGMENT_CACHE_SIZE = 2048 # rendered cards kept (LRU on memory)
+    FRAGMENT_CACHE_TTL = 3600 # seconds before a card is re-rendered anyway
+    # compiled templates, shared by workers and kept across restarts; None = off
+    TEMPLATE_CACHE_DIR = os.path.join(DATABASE_DIR, 'templates')
+    TEMPLATE_WARMUP = False # compile every template at startup, not first use
+    # login token buckets, shared by all workers via a local SQLite file
+    THROTTLE_DATABASE = os.path.join(DATABASE_DIR, 'throttle.db')
+    THROTTLE_MAX_IDLE = 3600 # seconds before an unused bucket is forgotten
+    LOGIN_IP_BURST = 20 # login attempts per address before throttling
+    LOGIN_IP_RATE = 20 / 60 # attempts regained per second, per address
+    LOGIN_ACCOUNT_BURST = 5 # login attempts per account before throttling
+    LOGIN_ACCOUNT_RATE = 5 / 300 # attempts regained per second, per account
+    PROXY_HOPS = 0 # trusted proxies appending to X-Forwarded-For; 0 = none
 
 
 class DevConfig(BaseConfig): # pylint: disable=too-few-public-methods
@@ -28,13 +75,48 @@ class TestConfig(BaseConfig): # pylint: disable=too-few-public-methods
     SQLALCHEMY_DATABASE_URI = os.environ.get('QQ_DATABASE_TEST') or \
         SQLITE_PREFIX + os.path.join(DATABASE_DIR, 'qqtest.db')
     TESTING = True
+    PASSWORD_HASH_WORKERS = 0 # the pool has its own tests
+    THROTTLE_DATABASE = os.path.join(DATABASE_DIR, 'qqtest-throttle.db')
+    CACHE_SQLITE_PATH = os.path.join(DATABASE_DIR, 'qqtest-cache.db')
+    TEMPLATE_CACHE_DIR = os.path.join(DATABASE_DIR, 'qqtest-templates')
+    LOGIN_IP_BURST = 1000 # the suite logs in constantly from one address;
+    LOGIN_ACCOUNT_BURST = 1000 # throttling has its own tests
+    PROXY_HOPS = 1 # as in production, so client addresses can be tested
 
 
 class ProdConfig(BaseConfig): # pylint: disable=too-few-public-methods
-    '''Configuration for deployed (AWS) instances of the app.'''
+    '''
+    Configuration for deployed (AWS) instances of the app.
+
+    Each web worker process gets its own connection pool, and SQLite only
+    ever runs one writer at a time, so pools stay small and writers queue on
+    `busy_timeout` instead of opening more connections. See the README.
+    '''
     SECRET_KEY = os.environ.get('QQ_SECRET_KEY') # or token_hex(32)
     SQLALCHEMY_DATABASE_URI = os.environ.get('QQ_DATABASE_URI') or \
         SQLITE_PREFIX + os.path.join(DATABASE_DIR, 'qqueue.db')
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        'pool_size': int(os.environ.get('QQ_POOL_SIZE') or 5),
+        'max_overflow': int(os.environ.get('QQ_POOL_OVERFLOW') or 5),
+        'pool_timeout': 10, # seconds to wait for a free connection
+        'pool_recycle': 1800, # seconds before a connection is replaced
+        'pool_pre_ping': True, # drop dead connections (non-SQLite URIs)
+    }
+    # share caches between workers; identities stay per worker
+    CACHE_BACKEND = os.environ.get('QQ_CACHE_BACKEND') or 'sqlite'
+    FRAGMENT_CACHE_BACKEND = os.environ.get('QQ_CACHE_BACKEND') or 'sqlite'
+    CACHE_REDIS_URL = os.environ.get('QQ_CACHE_URL') or \
+        BaseConfig.CACHE_REDIS_URL
+    FRAGMENT_CACHE_SIZE = 20000 # shared, so size for every worker's cards
+    TEMPLATE_WARMUP = True # new workers serve their first visitors at speed
+    # the load balancer and nginx each append to X-Forwarded-For
+    PROXY_HOPS = int(os.environ.get('QQ_PROXY_HOPS') or 2)
+    SQLITE_PRAGMAS = {
+        **BaseConfig.SQLITE_PRAGMAS,
+        'busy_timeout': int(os.environ.get('QQ_BUSY_TIMEOUT') or 10000),
+        'cache_size': -64000, # ~64 MB per connection
+        'mmap_size': 256 * 1024**2,
+    }
 
 
 ACCEPTED_CURRENCIES = ['USD', 'EUR', 'CAD'] + sorted([
@@ -0,0 +1,93 @@
+'''
+Denormalized per-user task counters.
+
+Each user row carries four counts so profile and directory pages can show
+them (or skip empty sections) without touching the task tables:
+
+    request_count   tasks the user has requested, archived ones included
+    order_count     tasks the user has accepted, archived ones included
+    open_count      the user's requests nobody has accepted yet
+    active_count    the user's accepted tasks that aren't approved yet
+
+Tasks likewise carry a `comment_count`, kept by the comment routes through
+`adjust_comments`.
+
+Writes that change them call `adjust` inside their own transaction, so the
+counts commit (or roll back) together with the task. `repair_counters`
+recomputes every count from the tables, for data written any other way.
+'''
+
+from sqlalchemy import func, select, update
+from qqueue.extensions import database
+from qqueue.models import User, Task, Comment, ArchivedTask, ArchivedComment
+from qqueue.states import TaskStatus
+
+COUNTERS = ['request_count', 'order_count', 'open_count', 'active_count']
+
+# counter changes per transition, for the (requester, provider)
+TRANSITION_DELTAS = {
+    'accept': ({'open_count': -1}, {'order_count': 1, 'active_count': 1}),
+    'release': ({'open_count': 1}, {'order_count': -1, 'active_count': -1}),
+    'complete': ({}, {}),
+    'approve': ({}, {'active_count': -1}),
+    'reject': ({}, {}),
+}
+
+def adjust(user_id:int, **deltas:int) -> None:
+    '''Adds `deltas` (e.g. `open_count=-1`) to the counters of `user_id`.'''
+    deltas = {name: delta for name, delta in deltas.items() if delta}
+    if not deltas: return
+    database.session.execute(
+        update(User).where(User.id == user_id)
+        .values(**{name: getattr(User, name) + delta
+                   for name, delta in deltas.items()},
+                updated_at=User.updated_at) # counters aren't profile edits
+        .execution_options(synchronize_session=False))
+
+def adjust_comments(task_id:int, delta:int) -> None:
+    '''Adds `delta` to the comment count of live task `task_id`.'''
+    database.session.execute(
+        update(Task).where(Task.id == task_id)
+        .values(comment_count=Task.comment_count + delta,
+                updated_at=Task.updated_at) # a comment isn't a task edit
+        .execution_options(synchronize_session=False))
+
+def count_tasks(column:str, statuses:list|None=None):
+    '''
+    Correlated subquery counting the live and archived tasks whose `column`
+    is the user being updated, optionally only those in `statuses`.
+    '''
+    total = 0
+    for model in [Task, ArchivedTask]:
+        criteria = [getattr(model, column) == User.id]
+        if statuses: criteria.append(model.status.in_(statuses))
+        total = total + select(func.count()).select_from(model)\
+            .where(*criteria).scalar_subquery()
+    return total
+
+def recount():
+    '''Returns the UPDATE that recomputes every user's counters.'''
+    return update(User).values(
+        request_count=count_tasks('requested_by'),
+        order_count=count_tasks('accepted_by'),
+        open_count=count_tasks('requested_by', [TaskStatus.OPEN]),
+        active_count=count_tasks('accepted_by', [TaskStatus.ACCEPTED,
+                                                 TaskStatus.COMPLETED]),
+        updated_at=User.updated_at,
+    )
+
+def recount_comments() -> list:
+    '''Returns the UPDATEs that recompute every task's comment count.'''
+    return [update(task).values(
+                comment_count=select(func.count()).select_from(comment)
+                .where(comment.task_id == task.id).scalar_subquery(),
+                updated_at=task.updated_at)
+            for task, comment in [(Task, Comment),
+                                  (ArchivedTask, ArchivedComment)]]
+
+def repair_counters() -> None:
+    '''Recomputes every user and task counter from the tables (no commit).'''
+    for statement in [recount(), *recount_comments()]:
+        database.session.execute(
+            statement.execution_options(synchronize_session=False))
+    database.session.expire_all()
@@ -0,0 +1,78 @@
+'''
+Streaming CSV/JSONL export of a user's task history, including comments.
+
+Tasks are read with a single task-LEFT-JOIN-comment query (over both the
+live and archive tables) executed with `yield_per`, which streams rows from a
+server-side cursor in fixed-size chunks. Consecutive rows are grouped per
+task, so at most one task's comments are held at a time no matter how long
+the history is.
+'''
+
+import csv
+import io
+import json
+from itertools import groupby
+from typing import Iterator
+from sqlalchemy import select, union_all
+from qqueue.extensions import database
+from qqueue.models import Task, Comment, ArchivedTask, ArchivedComment
+
+FORMATS = ['csv', 'jsonl']
+TASK_COLUMNS = ['id', 'summary', 'detail', 'reward_amount', 'reward_currency',
+                'due_by', 'requested_at', 'requested_by', 'accepted_at',
+                'accepted_by', 'completed_at', 'approved_at', 'rejected_at']
+COMMENT_COLUMNS = ['id', 'created_at', 'created_by', 'text']
+
+def history_rows(user_id:int, batch_size:int) -> Iterator:
+    '''Streams (task columns..., comment columns...) rows for `user_id`.'''
+    def history(task, comment):
+        return select(*[getattr(task, c) for c in TASK_COLUMNS],
+                      *[getattr(comment, c).label(f'comment_{c}')
+                        for c in COMMENT_COLUMNS])\
+            .outerjoin(comment, comment.task_id == task.id)\
+            .where(database.or_(task.requested_by == user_id,
+                                task.accepted_by == user_id))
+    rows = union_all(history(Task, Comment),
+                     history(ArchivedTask, ArchivedComment)).subquery()
+    stmt = select(rows).order_by(rows.c.id, rows.c.comment_id)\
+        .execution_options(yield_per=batch_size)
+    yield from database.session.execute(stmt)
+
+def to_json(value):
+    '''Makes dates and datetimes JSON serializable.'''
+    return value.isoformat() if hasattr(value, 'isoformat') else value
+
+def export_csv(user_id:int, batch_size:int) -> Iterator[str]:
+    '''Yields a CSV with one line per task comment (or per bare task).'''
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    def flush() -> str:
+        line = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return line
+    writer.writerow(TASK_COLUMNS + [f'comment_{c}' for c in COMMENT_COLUMNS])
+    yield flush()
+    for row in history_rows(user_id, batch_size):
+        writer.writerow(row)
+        yield flush()
+
+def export_jsonl(user_id:int, batch_size:int) -> Iterator[str]:
+    '''Yields one JSON object per task, with its comments nested inside.'''
+    rows = history_rows(user_id, batch_size)
+    for _, group in groupby(rows, key=lambda row: row.id):
+        task, comments = None, []
+        for row in group:
+            if task is None:
+                task = {c: to_json(getattr(row, c)) for c in TASK_COLUMNS}
+            if row.comment_id is not None:
+                comments.append({c: to_json(getattr(row, f'comment_{c}'))
+                                 for c in COMMENT_COLUMNS})
+        yield json.dumps({**task, 'comments': comments}) + '\n'
+
+def export_history(user_id:int, file_format:str, batch_size:int) -> Iterator[str]: # pylint: disable=line-too-long
+    '''Yields the export for `user_id` in `file_format`.'''
+    match file_format:
+        case 'csv': return export_csv(user_id, batch_size)
+        case 'jsonl': return export_jsonl(user_id, batch_size)
+        case _: raise ValueError(f'Unsupported export format: {file_format}')
@@ -1,15 +1,252 @@
 '''Separate file for flask extensions to avoid circular references.'''
 
-from flask import current_app, request, abort
+from collections import OrderedDict
+from time import monotonic
+from flask import Flask, current_app, request, abort, get_template_attribute
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
+from sqlalchemy import Engine, event, tuple_
+from functools import cache as memoize
+from markupsafe import Markup
+from qqueue.caching import SQLiteBackend, RedisBackend
+from qqueue.templating import template_version
+import sqlite3
 import warnings
-warnings.simplefilter('ignore') # ignore DeprecationWarning in web3
-from web3 import Web3, EthereumTesterProvider
+
+class TTLCache():
+    '''
+    Minimal in-process cache whose entries expire `ttl` seconds after they're
+    set. If `max_entries` is given, the least recently used entry is evicted
+    to make room. Each worker keeps its own copy, so only use it for values
+    where a few seconds of staleness is acceptable.
+    '''
+    def __init__(self, max_entries:int|None=None):
+        self.max_entries = max_entries
+        self.evictions = 0
+        self._entries = OrderedDict()
+
+    def get(self, key, default=None):
+        '''Returns the value stored under `key`, or `default` if expired.'''
+        expires_at, value = self._entries.get(key, (None, default))
+        if expires_at is None: return default
+        if expires_at < monotonic():
+            del self._entries[key]
+            self.evictions += 1
+            return default
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key, value, ttl:float) -> None:
+        '''Stores `value` under `key` for `ttl` seconds.'''
+        self._entries[key] = (monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+        if self.max_entries is not None:
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key) -> None:
+        '''Removes `key` from the cache, if present.'''
+        self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        '''Removes every entry.'''
+        self._entries.clear()
+
+
+class Cache():
+    '''
+    Cache extension: one namespace of entries on the backend named by the
+    `backend_setting` config value, holding up to `size_setting` entries:
+
+        memory  a per-worker `TTLCache` (LRU with expiry)
+        sqlite  a `SQLiteBackend` file in `CACHE_SQLITE_PATH`, shared by
+                the workers on one host
+        redis   a `RedisBackend` at `CACHE_REDIS_URL`, shared by every host
+
+    Counts hits and misses for `stats`, alongside the backend's evictions.
+    Entries are emptied on every test app.
+
+    A cache is only ever an optimization, so backend failures (a server
+    that's down, a locked cache file) are logged and counted as `errors`,
+    then treated as a miss or a no-op. A failing backend is skipped for
+    `RETRY_AFTER` seconds so requests don't each wait on its timeout.
+    '''
+    MISSING = object()
+    ERRORS = (OSError, sqlite3.Error, RuntimeError)
+    RETRY_AFTER = 5 # seconds a failing backend is left alone
+
+    def __init__(self, namespace:str, backend_setting:str='CACHE_BACKEND',
+                 size_setting:str='CACHE_SIZE'):
+        self.namespace = namespace
+        self.backend_setting = backend_setting
+        self.size_setting = size_setting
+        self.backend = TTLCache()
+        self.hits = self.misses = self.errors = 0
+        self.down_until = 0.0
+
+    def init_app(self, app:Flask) -> None:
+        '''Connects to the configured backend and resets the stats.'''
+        name = app.config[self.backend_setting]
+        max_entries = app.config[self.size_setting]
+        match name:
+            case 'memory':
+                self.backend = TTLCache(max_entries=max_entries)
+            case 'sqlite':
+                self.backend = SQLiteBackend(app.config['CACHE_SQLITE_PATH'],
+                                             self.namespace, max_entries)
+            case 'redis':
+                self.backend = RedisBackend(app.config['CACHE_REDIS_URL'],
+                                            self.namespace)
+            case _:
+                raise ValueError(f'Unknown cache backend: {name}')
+        self.hits = self.misses = self.errors = 0
+        self.down_until = 0.0
+        if app.testing: self.call('clear')
+
+    def call(self, action:str, *args, default=None):
+        '''
+        Runs `action` on the backend, or returns `default` if it fails (or
+        failed less than `RETRY_AFTER` seconds ago).
+        '''
+        if monotonic() < self.down_until: return default
+        try:
+            return getattr(self.backend, action)(*args)
+        except self.ERRORS as error:
+            self.errors += 1
+            self.down_until = monotonic() + self.RETRY_AFTER
+            current_app.logger.warning(f'Cache "{self.namespace}" {action} failed: {error!r}') # pylint: disable=line-too-long
+            return default
+
+    def get(self, key, default=None):
+        '''Returns the value stored under `key`, or `default` if expired.'''
+        value = self.call('get', key, self.MISSING, default=self.MISSING)
+        if value is self.MISSING:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return value
+
+    def set(self, key, value, ttl:float) -> None:
+        '''Stores `value` under `key` for `ttl` seconds.'''
+        self.call('set', key, value, ttl)
+
+    def delete(self, key) -> None:
+        '''Removes `key` from the cache, if present.'''
+        self.call('delete', key)
+
+    @property
+    def stats(self) -> dict:
+        '''
+        This worker's hits, misses and backend errors, and the backend's
+        evictions.
+        '''
+        return {'hits': self.hits, 'misses': self.misses,
+                'errors': self.errors, 'evictions': self.backend.evictions}
+
+
+class FragmentCache():
+    '''
+    Cache of rendered card HTML (the `display_task`/`display_user` macros),
+    so listing pages can stitch pre-rendered cards together instead of
+    rendering (and lazy-loading) every row on every request.
+
+    Entries are keyed by entity kind, id and macro variant, and stored along
+    with a stamp of the row (e.g. its version), so a row changed by any
+    writer simply misses. Write routes also call `invalidate` to free the
+    entry straight away. Entries live in a `Cache` configured by
+    `FRAGMENT_CACHE_BACKEND` and `FRAGMENT_CACHE_SIZE`.
+    '''
+    VARIANTS = {'task': [False, True], 'user': [False, True]}
+
+    def __init__(self):
+        self.backend = Cache('fragments', 'FRAGMENT_CACHE_BACKEND',
+                             'FRAGMENT_CACHE_SIZE')
+        self.ttl = 3600
+
+    def init_app(self, app:Flask) -> None:
+        '''Sets up the backend and exposes `task_card`/`user_card` to Jinja.'''
+        self.backend.init_app(app)
+        self.ttl = app.config['FRAGMENT_CACHE_TTL']
+        app.jinja_env.globals.update(task_card=self.task_card,
+                                     user_card=self.user_card)
+
+    def render(self, kind:str, entity_id:int, variant:bool, stamp,
+               macro:str, *args) -> Markup:
+        '''
+        Returns the cached output of `macro(*args)` for this entity, or
+        renders and stores it if there's none for `stamp`. The stamp also
+        carries the version of `macros.html`, so cards rendered before a
+        deploy miss in shared backends too.
+        '''
+        stamp = (template_version('macros.html'), stamp)
+        key = (kind, entity_id, variant)
+        cached = self.backend.get(key)
+        if cached is not None and cached[0] == stamp:
+            return Markup(cached[1])
+        html = str(get_template_attribute('macros.html', macro)(*args))
+        self.backend.set(key, (stamp, html), ttl=self.ttl)
+        return Markup(html)
+
+    def task_card(self, task, hide_requester:bool=False) -> Markup:
+        '''
+        `display_task`, cached per task version and, when the requester is
+        shown, their last profile edit (so renames miss too). Load
+        `Task.requester` with the listing to keep the stamp query-free.
+        '''
+        hide_requester = bool(hide_requester)
+        stamp = task.version if hide_requester else\
+            (task.version, task.requester.updated_at)
+        return self.render('task', task.id, hide_requester, stamp,
+                           'display_task', task, hide_requester)
+
+    def user_card(self, user, show_bio:bool=True) -> Markup:
+        '''`display_user`, cached per profile edit and task counts.'''
+        stamp = (user.updated_at, getattr(user, 'open_count', None),
+                 getattr(user, 'active_count', None))
+        return self.render('user', user.id, bool(show_bio), stamp,
+                           'display_user', user, show_bio)
+
+    def invalidate(self, kind:str, *entity_ids:int) -> None:
+        '''Drops every cached card of `kind` for `entity_ids`.'''
+        for entity_id in entity_ids:
+            for variant in self.VARIANTS[kind]:
+                self.backend.delete((kind, entity_id, variant))
+
 
 database = SQLAlchemy()
 login = LoginManager()
-w3 = Web3(EthereumTesterProvider())
+cache = Cache('app') # route-level values, e.g. the task teaser
+identities = Cache('identities', 'IDENTITY_CACHE_BACKEND',
+                   'IDENTITY_CACHE_SIZE') # logged in users, see load_user
+fragments = FragmentCache() # rendered cards, see task_card/user_card
+
+def configure_sqlite(engine:Engine, pragmas:dict) -> None:
+    '''
+    Runs `PRAGMA name=value` for each of `pragmas` on every new connection
+    `engine` opens, since most SQLite settings only last for a connection.
+    Does nothing for other databases.
+    '''
+    if engine.dialect.name != 'sqlite' or not pragmas: return
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, _) -> None:
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name}={value}')
+        cursor.close()
+
+@memoize
+def get_w3():
+    '''
+    Returns this process's chain client, creating it on first use. web3 and
+    its in-memory test chain are heavy, so they're only loaded once an
+    on-chain feature actually needs them; address checks live in
+    `qqueue.addresses` instead.
+    '''
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore') # ignore DeprecationWarning in web3
+        from web3 import Web3, EthereumTesterProvider # pylint: disable=import-outside-toplevel
+        return Web3(EthereumTesterProvider())
 
 def endpoint_exception() -> None:
     '''
@@ -19,6 +256,26 @@ def endpoint_exception() -> None:
     current_app.logger.warning(f'405: {request.path} {request.method}: {request}') # pylint: disable=line-too-long
     abort(405)
 
+def keyset_page(query, keys:list, after:tuple|None, limit:int, descending:bool=False) -> tuple[list, tuple|None]: # pylint: disable=line-too-long
+    '''
+    Returns up to `limit` rows of `query` ordered by the columns in `keys`
+    (highest first if `descending`), starting after the row whose key values
+    equal `after`, along with the cursor for the next page (`None` if this
+    is the last page).
+
+    Keyset (seek) pagination keeps the cost of each page constant, unlike
+    OFFSET, which has to scan past every row that came before it.
+    '''
+    if after is not None:
+        query = query.filter(tuple_(*keys) < tuple(after) if descending
+                             else tuple_(*keys) > tuple(after))
+    order = [key.desc() for key in keys] if descending else keys
+    rows = query.order_by(*order).limit(limit + 1).all()
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, tuple(getattr(rows[-1], key.key) for key in keys)
+
 # No type hints as this would cause circular imports because of database
 # being imported into qqueue.models. TODO: fix this
 def display_user(user):
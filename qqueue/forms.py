@@ -1,7 +1,8 @@
 '''Secured forms for qqueue built on WTForms + Flask-WTF.'''
 
-from wtforms import EmailField, StringField, PasswordField, TextAreaField, FloatField, SelectField, DateField
-from wtforms.validators import DataRequired, Length, NumberRange
+from datetime import date
+from wtforms import EmailField, StringField, PasswordField, TextAreaField, FloatField, SelectField, DateField, FileField
+from wtforms.validators import DataRequired, Length, NumberRange, ValidationError
 from flask_wtf import FlaskForm
 from qqueue.config import ACCEPTED_CURRENCIES
 
@@ -58,6 +59,16 @@ class TaskForm(FlaskForm):
                                   validators=[DataRequired()])
     due_by = DateField('Due By', validators=[DataRequired()])
 
+    def validate_due_by(self, field:DateField) -> None:
+        '''Rejects due dates in the past.'''
+        if field.data and field.data < date.today():
+            raise ValidationError('Due date cannot be in the past.')
+
+
+# task import
+class ImportForm(FlaskForm):
+    file = FileField('CSV or JSONL File', validators=[DataRequired()])
+
 
 # comment
 class CommentForm(FlaskForm):
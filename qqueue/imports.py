@@ -0,0 +1,100 @@
+'''
+Bulk task import from CSV or JSONL.
+
+Rows are parsed one at a time from the incoming stream, validated with the
+same `TaskForm` the web form uses, and inserted in batches of
+`IMPORT_BATCH_SIZE` per transaction. Results come back as a generator of
+report entries (one per rejected row, then a summary), so neither the file
+nor the report is ever held in memory as a whole.
+'''
+
+import csv
+import io
+import json
+from typing import IO, Iterator
+from sqlalchemy import insert
+from werkzeug.datastructures import MultiDict
+from qqueue.extensions import database
+from qqueue.forms import TaskForm
+from qqueue.models import Task
+from qqueue.counters import adjust
+
+FORMATS = ['csv', 'jsonl']
+TASK_COLUMNS = ['summary', 'detail', 'reward_amount', 'reward_currency',
+                'due_by']
+
+def detect_format(filename:str) -> str|None:
+    '''Guesses the import format from a file name.'''
+    extension = filename.rsplit('.', 1)[-1].lower()
+    if extension == 'ndjson': return 'jsonl'
+    return extension if extension in FORMATS else None
+
+def parse_rows(stream:IO[bytes], file_format:str) -> Iterator[tuple[int, dict|None, str|None]]: # pylint: disable=line-too-long
+    '''
+    Yields (line number, row, error) for each record in `stream`, where
+    exactly one of `row` or `error` is set.
+    '''
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    if file_format == 'csv':
+        reader = csv.DictReader(text)
+        for row in reader:
+            yield reader.line_num, row, None
+    elif file_format == 'jsonl':
+        for line_num, line in enumerate(text, start=1):
+            if not line.strip(): continue
+            try:
+                row = json.loads(line)
+            except json.JSONDecodeError as error:
+                yield line_num, None, f'Invalid JSON: {error.msg}'
+                continue
+            if isinstance(row, dict):
+                yield line_num, row, None
+            else:
+                yield line_num, None, 'Each line must be a JSON object.'
+    else:
+        raise ValueError(f'Unsupported import format: {file_format}')
+
+def validate_row(row:dict) -> tuple[dict|None, list[str]]:
+    '''
+    Runs `row` through `TaskForm` and returns the cleaned task values, or
+    `None` and the list of problems.
+    '''
+    formdata = MultiDict({column: str(row.get(column) or '')
+                          for column in TASK_COLUMNS})
+    form = TaskForm(formdata=formdata, meta={'csrf': False})
+    if not form.validate():
+        return None, [f'{field}: {message}'
+                      for field, messages in form.errors.items()
+                      for message in messages]
+    return {column: getattr(form, column).data
+            for column in TASK_COLUMNS}, []
+
+def import_tasks(stream:IO[bytes], file_format:str, requested_by:int,
+                 batch_size:int) -> Iterator[dict]:
+    '''
+    Imports every valid row in `stream` as a task requested by `requested_by`.
+    Yields a report entry for each rejected row and a final summary.
+    '''
+    imported = rejected = 0
+    batch = []
+    def flush() -> None:
+        nonlocal imported
+        if not batch: return
+        database.session.execute(insert(Task), batch)
+        adjust(requested_by, request_count=len(batch), open_count=len(batch))
+        database.session.commit()
+        imported += len(batch)
+        batch.clear()
+
+    for line_num, row, error in parse_rows(stream, file_format):
+        errors = [error] if error else []
+        if row is not None:
+            task, errors = validate_row(row)
+        if errors:
+            rejected += 1
+            yield {'line': line_num, 'errors': errors}
+            continue
+        batch.append({**task, 'requested_by': requested_by})
+        if len(batch) >= batch_size: flush()
+    flush()
+    yield {'imported': imported, 'rejected': rejected}
@@ -0,0 +1,211 @@
+'''
+Versioned schema migrations for qqueue databases.
+
+The database records the number of migrations applied to it in the
+`schema_version` table. At startup that single row is compared against
+`MIGRATIONS`; if it's current nothing else happens, otherwise each pending
+step runs in its own transaction and bumps the version when it commits.
+
+Steps are plain functions registered in order with `@migration`, so new ones
+go at the bottom of this file. Each step must be safe to re-run against a
+database that already has its changes, since a fresh database is built
+directly from the models and databases from before versioning start at 0.
+'''
+
+from flask import Flask
+from sqlalchemy import Column, Integer, Table, Connection, inspect, select, text
+from sqlalchemy.exc import OperationalError, ProgrammingError
+from sqlalchemy.schema import CreateColumn, CreateTable
+from qqueue.extensions import database
+from qqueue.states import TaskStatus
+
+schema_version = Table('schema_version', database.metadata,
+                       Column('version', Integer, nullable=False))
+
+MIGRATIONS = [] # applied in order; the schema version is len(MIGRATIONS)
+
+def migration(step):
+    '''Registers `step` as the next migration.'''
+    MIGRATIONS.append(step)
+    return step
+
+# Helpers
+
+def get_version(connection:Connection) -> int|None:
+    '''Returns the stored schema version, or `None` if it isn't tracked.'''
+    try:
+        return connection.execute(select(schema_version.c.version)).scalar()
+    except (OperationalError, ProgrammingError):
+        connection.rollback()
+        return None
+
+def set_version(connection:Connection, version:int) -> None:
+    '''Overwrites the stored schema version with `version`.'''
+    connection.execute(schema_version.delete())
+    connection.execute(schema_version.insert().values(version=version))
+
+def add_column(connection:Connection, table_name:str, column_name:str) -> None:
+    '''Adds a column as declared on the model, if the table lacks it.'''
+    existing = inspect(connection).get_columns(table_name)
+    if column_name in {column['name'] for column in existing}: return
+    column = database.metadata.tables[table_name].c[column_name]
+    ddl = CreateColumn(column).compile(dialect=connection.dialect)
+    table_name = connection.dialect.identifier_preparer.quote(table_name)
+    connection.execute(text(f'ALTER TABLE {table_name} ADD COLUMN {ddl}'))
+
+def create_indexes(connection:Connection, *table_names:str) -> None:
+    '''Builds any indexes declared on the models that don't exist yet.'''
+    for table_name in table_names:
+        existing = {column['name']
+                    for column in inspect(connection).get_columns(table_name)}
+        for index in database.metadata.tables[table_name].indexes:
+            # later steps add the columns (and so indexes) that don't exist yet
+            if {column.name for column in index.columns} <= existing:
+                index.create(bind=connection, checkfirst=True)
+
+def rebuild_table(connection:Connection, table_name:str) -> None:
+    '''
+    Recreates a SQLite table from its model (e.g. for table options ALTER
+    can't change), keeping its rows. Indexes are rebuilt; triggers are lost.
+    '''
+    table = database.metadata.tables[table_name]
+    quote = connection.dialect.identifier_preparer.quote
+    existing = {column['name']
+                for column in inspect(connection).get_columns(table_name)}
+    columns = ', '.join(quote(column.name) for column in table.columns
+                        if column.name in existing) # later steps add the rest
+    ddl = str(CreateTable(table).compile(dialect=connection.dialect))
+    temp_name = f'_{table_name}_rebuild'
+    ddl = ddl.replace(quote(table_name), quote(temp_name), 1)
+    connection.execute(text(ddl))
+    connection.execute(text(f'INSERT INTO {quote(temp_name)} ({columns}) '
+                            f'SELECT {columns} FROM {quote(table_name)}'))
+    connection.execute(text(f'DROP TABLE {quote(table_name)}'))
+    connection.execute(text(f'ALTER TABLE {quote(temp_name)} '
+                            f'RENAME TO {quote(table_name)}'))
+    create_indexes(connection, table_name)
+
+# Entry points
+
+def stamp_database() -> None:
+    '''Marks the database as current. Only for schemas built by create_all().'''
+    with database.engine.begin() as connection:
+        set_version(connection, len(MIGRATIONS))
+
+def upgrade_database(app:Flask) -> None:
+    '''Applies any pending migrations. Costs one query if already current.'''
+    target = len(MIGRATIONS)
+    with database.engine.connect() as connection:
+        version = get_version(connection)
+        if version == target: return
+        if version is None: # untracked, so either brand new or pre-versioning
+            if not inspect(connection).get_table_names():
+                app.logger.info('Creating database at schema version '
+                                f'{target}...')
+                database.metadata.create_all(bind=connection)
+                set_version(connection, target)
+                connection.commit()
+                return
+            schema_version.create(bind=connection, checkfirst=True)
+            connection.commit()
+            version = 0
+    if version > target:
+        raise RuntimeError(f'Database schema version {version} is newer than '
+                           f'this build of qqueue ({target}).')
+    for i, step in enumerate(MIGRATIONS[version:], start=version+1):
+        app.logger.info(f'Migrating database to version {i}: {step.__name__}')
+        with database.engine.begin() as connection:
+            step(connection)
+            set_version(connection, i)
+
+# Migrations - add new steps at the bottom, never reorder or remove
+
+@migration
+def create_base_tables(connection:Connection) -> None:
+    '''Creates the user, task and comment tables if they don't exist.'''
+    tables = [database.metadata.tables[name]
+              for name in ['user', 'task', 'comment']]
+    database.metadata.create_all(bind=connection, tables=tables)
+
+@migration
+def index_hot_columns(connection:Connection) -> None:
+    '''Adds the composite indexes behind the task board and comment lookups.'''
+    create_indexes(connection, 'task', 'comment')
+
+@migration
+def create_task_search_index(connection:Connection) -> None:
+    '''Adds the FTS5 index behind /tasks/search (SQLite only).'''
+    from qqueue.search import create_search_index # pylint: disable=import-outside-toplevel
+    create_search_index(connection)
+
+@migration
+def add_updated_at(connection:Connection) -> None:
+    '''Adds the `updated_at` stamps behind API ETags, backfilled from history.'''
+    add_column(connection, 'user', 'updated_at')
+    add_column(connection, 'task', 'updated_at')
+    user, task = database.metadata.tables['user'], database.metadata.tables['task'] # pylint: disable=line-too-long
+    connection.execute(user.update().where(user.c.updated_at == None)
+                       .values(updated_at=user.c.created_at))
+    connection.execute(task.update().where(task.c.updated_at == None)
+                       .values(updated_at=database.func.coalesce(
+                           task.c.approved_at, task.c.completed_at,
+                           task.c.accepted_at, task.c.requested_at)))
+
+@migration
+def add_task_version(connection:Connection) -> None:
+    '''Adds the row version checked by conditional task transitions.'''
+    add_column(connection, 'task', 'version')
+
+@migration
+def add_task_status(connection:Connection) -> None:
+    '''Adds the explicit `status` column, backfilled from the timestamps.'''
+    add_column(connection, 'task', 'status')
+    task = database.metadata.tables['task']
+    connection.execute(task.update().values(status=database.case(
+        (task.c.approved_at != None, TaskStatus.APPROVED.value),
+        (task.c.completed_at != None, TaskStatus.COMPLETED.value),
+        (task.c.accepted_at != None, TaskStatus.ACCEPTED.value),
+        else_=TaskStatus.OPEN.value)))
+    for name in ['ix_task_state_due', 'ix_task_requester', 'ix_task_provider']:
+        connection.execute(text(f'DROP INDEX IF EXISTS {name}'))
+    create_indexes(connection, 'task')
+
+@migration
+def create_archive_tables(connection:Connection) -> None:
+    '''
+    Adds the archive behind the hot/cold split. On SQLite, `task` and
+    `comment` are rebuilt with AUTOINCREMENT first, since SQLite otherwise
+    reuses the highest id once it's deleted, and archived rows keep theirs.
+    '''
+    if connection.dialect.name == 'sqlite':
+        for table_name in ['task', 'comment']:
+            ddl = connection.execute(text(
+                "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = :name" # pylint: disable=line-too-long
+            ), {'name': table_name}).scalar()
+            if 'AUTOINCREMENT' not in ddl.upper():
+                rebuild_table(connection, table_name)
+        from qqueue.search import create_search_index # pylint: disable=import-outside-toplevel
+        create_search_index(connection) # its triggers went with the old table
+    tables = [database.metadata.tables[name]
+              for name in ['task_archive', 'comment_archive']]
+    database.metadata.create_all(bind=connection, tables=tables)
+
+@migration
+def add_user_counters(connection:Connection) -> None:
+    '''Adds the denormalized task counters to users and fills them in.'''
+    for name in ['request_count', 'order_count', 'open_count', 'active_count']:
+        add_column(connection, 'user', name)
+    from qqueue.counters import recount # pylint: disable=import-outside-toplevel
+    connection.execute(recount())
+
+@migration
+def add_comment_counts(connection:Connection) -> None:
+    '''Adds per-task comment counts and re-indexes comments for paging.'''
+    add_column(connection, 'task', 'comment_count')
+    add_column(connection, 'task_archive', 'comment_count')
+    from qqueue.counters import recount_comments # pylint: disable=import-outside-toplevel
+    for statement in recount_comments():
+        connection.execute(statement)
+    for name in ['ix_comment_task', 'ix_comment_archive_task']:
+        connection.execute(text(f'DROP INDEX IF EXISTS {name}'))
+    create_indexes(connection, 'comment', 'comment_archive')
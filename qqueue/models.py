@@ -1,10 +1,14 @@
 '''Data models used by SQLAlchemy to build qqueue's database tables.'''
 
+from datetime import datetime
 from flask_login import UserMixin
-from sqlalchemy import Column, Integer, String, Date, DateTime, Text, Float, func, ForeignKey
+from sqlalchemy import Column, Integer, String, Date, DateTime, Text, Float, Enum, func, ForeignKey, Index
 from qqueue.extensions import database
+from qqueue.states import TaskStatus, initial_status
 
 CASCADE = 'all, delete-orphan' # shorthand for FK relationships
+STATUS_TYPE = Enum(TaskStatus, native_enum=False, length=16, # stores 'open' etc.
+                   values_callable=lambda members: [m.value for m in members])
 
 class User(UserMixin, database.Model): # pylint: disable=too-few-public-methods
     '''Defines the table fields for registered users.'''
@@ -16,19 +20,44 @@ class User(UserMixin, database.Model): # pylint: disable=too-few-public-methods
     created_at = Column(DateTime(timezone=True), server_default=func.now()) # pylint: disable=not-callable
     headline = Column(String(256))
     bio = Column(Text)
+    # set client-side for sub-second precision, since it backs API ETags
+    updated_at = Column(DateTime(timezone=True), default=datetime.now, onupdate=datetime.now) # pylint: disable=line-too-long
+    # maintained by qqueue.counters alongside every task write
+    request_count = Column(Integer, nullable=False, default=0, server_default='0') # pylint: disable=line-too-long
+    order_count = Column(Integer, nullable=False, default=0, server_default='0')
+    open_count = Column(Integer, nullable=False, default=0, server_default='0')
+    active_count = Column(Integer, nullable=False, default=0, server_default='0') # pylint: disable=line-too-long
+    # dynamic, so callers filter/paginate in SQL instead of loading them all
     requests = database.relationship('Task',
                                      primaryjoin='User.id == Task.requested_by',
                                      backref='requester',
-                                     cascade=CASCADE)
+                                     cascade=CASCADE,
+                                     lazy='dynamic')
     orders = database.relationship('Task',
                                    primaryjoin='User.id == Task.accepted_by',
                                    backref='provider',
-                                   cascade=CASCADE)
+                                   cascade=CASCADE,
+                                   lazy='dynamic')
     comments = database.relationship('Comment', backref='user', cascade=CASCADE)
     def __str__(self):
         return self.username
 
 
+class UserSnapshot(UserMixin): # pylint: disable=too-few-public-methods
+    '''
+    Detached copy of the `User` columns needed to authorize a request, which
+    `load_user` can cache between requests. Anything else needs a real query.
+    '''
+    __slots__ = ('id', 'username')
+
+    def __init__(self, user:User):
+        self.id = user.id
+        self.username = user.username
+
+    def __str__(self):
+        return self.username
+
+
 class Task(database.Model): # pylint: disable=too-few-public-methods
     '''Defines the table fields for tasks.'''
     id = Column(Integer, primary_key=True)
@@ -44,7 +73,25 @@ class Task(database.Model): # pylint: disable=too-few-public-methods
     completed_at = Column(DateTime(timezone=True))
     approved_at = Column(DateTime(timezone=True))
     rejected_at = Column(DateTime(timezone=True))
+    # maintained by qqueue.states; the timestamps above are only history
+    status = Column(STATUS_TYPE, nullable=False, default=initial_status,
+                    server_default=TaskStatus.OPEN.value)
+    updated_at = Column(DateTime(timezone=True), default=datetime.now, onupdate=datetime.now) # pylint: disable=line-too-long
+    # maintained by the comment routes, so task pages needn't count them
+    comment_count = Column(Integer, nullable=False, default=0, server_default='0') # pylint: disable=line-too-long
+    # bumped by every write; ORM updates fail (StaleDataError) if it moved
+    version = Column(Integer, nullable=False, server_default='0')
     comments = database.relationship('Comment', backref='task', cascade=CASCADE)
+    __mapper_args__ = {'version_id_col': version}
+    __table_args__ = (
+        # task board: one status at a time, ordered by due_by
+        Index('ix_task_status_due', 'status', 'due_by', 'id'),
+        # requester/provider views: own tasks by status, ordered by due_by
+        Index('ix_task_requester_status', 'requested_by', 'status', 'due_by'),
+        Index('ix_task_provider_status', 'accepted_by', 'status', 'due_by'),
+        # ids are never reused, since archived tasks keep theirs
+        {'sqlite_autoincrement': True},
+    )
 
 
 class Comment(database.Model): # pylint: disable=too-few-public-methods
@@ -53,3 +100,57 @@ class Comment(database.Model): # pylint: disable=too-few-public-methods
     created_at = Column(DateTime(timezone=True), server_default=func.now()) # pylint: disable=not-callable
     created_by = Column(Integer, ForeignKey('user.id'), nullable=False)
     text = Column(Text, nullable=False)
+    __table_args__ = (
+        # threads are paged newest first by id (ids are never reused)
+        Index('ix_comment_thread', 'task_id', 'id'),
+        Index('ix_comment_author', 'created_by'),
+        {'sqlite_autoincrement': True},
+    )
+
+
+class ArchivedTask(database.Model): # pylint: disable=too-few-public-methods
+    '''
+    Approved tasks moved out of `task` by `qqueue.archive`. Same columns and
+    ids as `Task`, plus when the row was archived; never written otherwise.
+    '''
+    __tablename__ = 'task_archive'
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    summary = Column(String(256), nullable=False)
+    detail = Column(Text, nullable=False)
+    reward_amount = Column(Float, nullable=False)
+    reward_currency = Column(String(16), nullable=False)
+    due_by = Column(Date(), nullable=False)
+    requested_at = Column(DateTime(timezone=True))
+    requested_by = Column(Integer, ForeignKey('user.id'), nullable=False)
+    accepted_at = Column(DateTime(timezone=True))
+    accepted_by = Column(Integer, ForeignKey('user.id'))
+    completed_at = Column(DateTime(timezone=True))
+    approved_at = Column(DateTime(timezone=True))
+    rejected_at = Column(DateTime(timezone=True))
+    status = Column(STATUS_TYPE, nullable=False)
+    updated_at = Column(DateTime(timezone=True))
+    comment_count = Column(Integer, nullable=False, default=0, server_default='0') # pylint: disable=line-too-long
+    version = Column(Integer, nullable=False)
+    archived_at = Column(DateTime(timezone=True), default=datetime.now)
+    requester = database.relationship('User', foreign_keys=[requested_by])
+    provider = database.relationship('User', foreign_keys=[accepted_by])
+    comments = database.relationship('ArchivedComment', backref='task',
+                                     order_by='ArchivedComment.id')
+    __table_args__ = (
+        Index('ix_task_archive_requester', 'requested_by', 'due_by'),
+        Index('ix_task_archive_provider', 'accepted_by', 'due_by'),
+    )
+
+
+class ArchivedComment(database.Model): # pylint: disable=too-few-public-methods
+    '''Comments on archived tasks, moved alongside them.'''
+    __tablename__ = 'comment_archive'
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    task_id = Column(Integer, ForeignKey('task_archive.id'), nullable=False)
+    created_at = Column(DateTime(timezone=True))
+    created_by = Column(Integer, ForeignKey('user.id'), nullable=False)
+    text = Column(Text, nullable=False)
+    user = database.relationship('User')
+    __table_args__ = (
+        Index('ix_comment_archive_thread', 'task_id', 'id'),
+    )
@@ -0,0 +1,82 @@
+'''
+Password hashing for qqueue, kept off the request thread.
+
+Hashes are computed by werkzeug, but in a per-process `ProcessPoolExecutor`
+of `PASSWORD_HASH_WORKERS` processes so a burst of logins can't tie up every
+web worker on the KDF. At most `PASSWORD_HASH_QUEUE` hashes may be in flight
+per process; callers past that wait up to `PASSWORD_HASH_WAIT` seconds for a
+slot and then get `HashQueueFull`, which is answered with a 503.
+
+The method and cost come from `PASSWORD_HASH_METHOD`, and `needs_rehash`
+reports stored hashes that were made with different parameters so they can
+be upgraded the next time the plaintext is known (i.e. on login).
+'''
+
+import atexit
+from concurrent.futures import ProcessPoolExecutor
+from functools import cache as memoize
+from threading import BoundedSemaphore, Lock
+from flask import current_app
+from werkzeug.security import generate_password_hash, check_password_hash
+
+class HashQueueFull(Exception):
+    '''Raised when too many password hashes are already waiting to run.'''
+
+
+_pool = {'executor': None, 'slots': None}
+_pool_lock = Lock()
+
+def get_pool() -> tuple[ProcessPoolExecutor, BoundedSemaphore]:
+    '''Lazily starts this process's hashing pool, sized from the config.'''
+    with _pool_lock:
+        if _pool['executor'] is None:
+            config = current_app.config
+            _pool['executor'] = ProcessPoolExecutor(
+                max_workers=config['PASSWORD_HASH_WORKERS'])
+            _pool['slots'] = BoundedSemaphore(config['PASSWORD_HASH_QUEUE'])
+        return _pool['executor'], _pool['slots']
+
+def shutdown_pool() -> None:
+    '''Stops the hashing pool; the next hash will start a fresh one.'''
+    with _pool_lock:
+        if _pool['executor'] is not None:
+            _pool['executor'].shutdown(cancel_futures=True)
+        _pool['executor'] = _pool['slots'] = None
+
+atexit.register(shutdown_pool) # once per process, however often it restarts
+
+def run_hash(function, *args):
+    '''Runs `function` on the hashing pool (or inline, if it's disabled).'''
+    if not current_app.config['PASSWORD_HASH_WORKERS']:
+        return function(*args)
+    executor, slots = get_pool()
+    if not slots.acquire(timeout=current_app.config['PASSWORD_HASH_WAIT']):
+        raise HashQueueFull()
+    try:
+        return executor.submit(function, *args).result()
+    finally:
+        slots.release()
+
+def hash_password(password:str) -> str:
+    '''Hashes `password` with the configured method and salt length.'''
+    return run_hash(generate_password_hash, password,
+                    current_app.config['PASSWORD_HASH_METHOD'],
+                    current_app.config['PASSWORD_SALT_LENGTH'])
+
+def check_password(password_hash:str, password:str) -> bool:
+    '''Checks `password` against a stored hash.'''
+    return run_hash(check_password_hash, password_hash, password)
+
+@memoize
+def stored_method(method:str) -> str:
+    '''
+    The method string werkzeug stores for `method`, which fills in any
+    omitted costs (e.g. `scrypt` is stored as `scrypt:32768:8:1`). Costs one
+    hash per process and method.
+    '''
+    return generate_password_hash('', method).split('$', 1)[0]
+
+def needs_rehash(password_hash:str) -> bool:
+    '''True if `password_hash` wasn't made with the configured method/cost.'''
+    method = password_hash.split('$', 1)[0]
+    return method != stored_method(current_app.config['PASSWORD_HASH_METHOD'])
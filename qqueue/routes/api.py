@@ -0,0 +1,207 @@
+'''
+Read-only JSON API for qqueue, version 1. Includes:
+    /api/v1/tasks                       - Tasks visible to the current user
+    /api/v1/tasks/<task_id>             - A single task
+    /api/v1/tasks/<task_id>/comments    - Comments left on a task
+    /api/v1/comments/<comment_id>       - A single comment
+    /api/v1/users                       - All users
+    /api/v1/users/<user_id>             - A single user
+
+Every endpoint takes an optional `fields` parameter (comma separated) for
+sparse fieldsets, and lists take an `after` cursor from the previous page's
+`next` value. Responses carry strong ETags derived from the rows' ids and
+timestamps, which are checked against `If-None-Match` before anything else
+is loaded, so unchanged resources cost one narrow query and a 304.
+
+The task list only covers live tasks; single tasks and their comments are
+also found in the archive once they've been moved there.
+'''
+
+from enum import Enum
+from hashlib import sha1
+from flask import Blueprint, Response, request, current_app, jsonify, abort
+from flask_login import login_required, current_user
+from sqlalchemy.orm import load_only
+from werkzeug.exceptions import HTTPException
+from qqueue.models import User, Task, Comment, ArchivedTask, ArchivedComment
+from qqueue.extensions import database, keyset_page
+from qqueue.routes.tasks import encode_cursor, decode_cursor
+
+blueprint = Blueprint('api', __name__)
+
+# public fields per resource; never add `email`, `password` or `address`
+TASK_FIELDS = ['id', 'summary', 'detail', 'reward_amount', 'reward_currency',
+               'due_by', 'requested_at', 'requested_by', 'accepted_at',
+               'accepted_by', 'completed_at', 'approved_at', 'rejected_at',
+               'status', 'updated_at']
+USER_FIELDS = ['id', 'username', 'headline', 'bio', 'created_at', 'updated_at']
+COMMENT_FIELDS = ['id', 'task_id', 'created_by', 'created_at', 'text']
+
+# Helpers
+
+@blueprint.errorhandler(HTTPException)
+def json_error(error:HTTPException) -> Response:
+    '''Returns errors as JSON, since API clients won't parse the HTML pages.'''
+    return jsonify(error=error.name, message=error.description), error.code
+
+def requested_fields(allowed:list[str]) -> list[str]:
+    '''Parses the `fields` parameter against `allowed` (all if missing).'''
+    value = request.args.get('fields')
+    if not value: return allowed
+    fields = [field.strip() for field in value.split(',') if field.strip()]
+    unknown = sorted(set(fields) - set(allowed))
+    if unknown: abort(400, f'Unknown fields: {", ".join(unknown)}')
+    return ['id'] + [field for field in fields if field != 'id']
+
+def make_etag(fields:list[str], stamps:list[tuple]) -> str:
+    '''Hashes the fieldset and each row's (id, timestamp) into an ETag.'''
+    digest = sha1(','.join(fields).encode())
+    for row_id, stamp in stamps:
+        digest.update(f'|{row_id}:{stamp.isoformat() if stamp else ""}'.encode()) # pylint: disable=line-too-long
+    return digest.hexdigest()
+
+def not_modified(etag:str) -> Response|None:
+    '''Returns a 304 if the client already holds `etag`, otherwise `None`.'''
+    if etag in request.if_none_match:
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+    return None
+
+def serialize(row, fields:list[str]) -> dict:
+    '''Converts `row` into a JSON-safe dict with only `fields`.'''
+    data = dict()
+    for field in fields:
+        value = getattr(row, field)
+        if isinstance(value, Enum): value = value.value
+        data[field] = value.isoformat() if hasattr(value, 'isoformat') else value
+    return data
+
+def json_response(payload:dict, etag:str) -> Response:
+    '''Wraps `payload` with its ETag and a revalidation policy.'''
+    response = jsonify(payload)
+    response.set_etag(etag)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True # cache, but always revalidate
+    return response
+
+def fetch_ordered(model, ids:list[int], fields:list[str]) -> list:
+    '''Loads only `fields` for the rows in `ids`, keeping their order.'''
+    rows = model.query.options(load_only(*[getattr(model, f) for f in fields]))\
+        .filter(model.id.in_(ids))
+    rows = {row.id: row for row in rows}
+    return [rows[row_id] for row_id in ids]
+
+def visible_tasks(model=Task):
+    '''Tasks the current user may see: open ones, or ones they're part of.'''
+    return model.query.filter(database.or_(model.accepted_by == None,
+                                           model.requested_by == current_user.id,
+                                           model.accepted_by == current_user.id))
+
+def locate_task(task_id:int) -> tuple:
+    '''
+    Returns the (task, comment) models holding `task_id` if the current user
+    may see it, checking the live tables before the archive, plus the task's
+    (id, updated_at) stamp. Aborts with 404 otherwise.
+    '''
+    for model, comment_model in [(Task, Comment),
+                                 (ArchivedTask, ArchivedComment)]:
+        stamp = visible_tasks(model).with_entities(model.id, model.updated_at)\
+            .filter(model.id == task_id).first()
+        if stamp: return model, comment_model, stamp
+    abort(404)
+
+# Tasks
+
+@blueprint.route('/tasks')
+@login_required
+def list_tasks() -> Response:
+    '''Returns a page of visible tasks, ordered by due date.'''
+    fields = requested_fields(TASK_FIELDS)
+    keys = [Task.due_by, Task.id]
+    stamps, cursor = keyset_page(
+        visible_tasks().with_entities(Task.due_by, Task.id, Task.updated_at),
+        keys, decode_cursor(request.args.get('after')),
+        current_app.config['TASK_PAGE_SIZE'])
+    etag = make_etag(fields, [(row.id, row.updated_at) for row in stamps])
+    if (response := not_modified(etag)): return response
+    tasks = fetch_ordered(Task, [row.id for row in stamps], fields)
+    return json_response({'items': [serialize(task, fields) for task in tasks],
+                          'next': encode_cursor(cursor)}, etag)
+
+@blueprint.route('/tasks/<int:task_id>')
+@login_required
+def get_task(task_id:int) -> Response:
+    '''Returns a single task, if the current user may see it.'''
+    fields = requested_fields(TASK_FIELDS)
+    model, _, stamp = locate_task(task_id)
+    etag = make_etag(fields, [stamp])
+    if (response := not_modified(etag)): return response
+    task = fetch_ordered(model, [task_id], fields)[0]
+    return json_response(serialize(task, fields), etag)
+
+@blueprint.route('/tasks/<int:task_id>/comments')
+@login_required
+def list_comments(task_id:int) -> Response:
+    '''Returns a page of the comments on a task, oldest first.'''
+    fields = requested_fields(COMMENT_FIELDS)
+    _, model, _ = locate_task(task_id)
+    after = request.args.get('after', type=int)
+    stamps, cursor = keyset_page(
+        model.query.with_entities(model.id, model.created_at)\
+            .filter(model.task_id == task_id),
+        [model.id], None if after is None else (after,),
+        current_app.config['TASK_PAGE_SIZE'])
+    etag = make_etag(fields, stamps)
+    if (response := not_modified(etag)): return response
+    comments = fetch_ordered(model, [row.id for row in stamps], fields)
+    return json_response({'items': [serialize(c, fields) for c in comments],
+                          'next': cursor[0] if cursor else None}, etag)
+
+@blueprint.route('/comments/<int:comment_id>')
+@login_required
+def get_comment(comment_id:int) -> Response:
+    '''Returns a single comment, if the current user may see its task.'''
+    fields = requested_fields(COMMENT_FIELDS)
+    for model, task_model in [(Comment, Task), (ArchivedComment, ArchivedTask)]:
+        stamp = model.query.with_entities(model.id, model.created_at)\
+            .filter(model.id == comment_id, model.task_id.in_(
+                visible_tasks(task_model).with_entities(task_model.id)))\
+            .first()
+        if stamp: break
+    else:
+        abort(404)
+    etag = make_etag(fields, [stamp])
+    if (response := not_modified(etag)): return response
+    comment = fetch_ordered(model, [comment_id], fields)[0]
+    return json_response(serialize(comment, fields), etag)
+
+# Users
+
+@blueprint.route('/users')
+@login_required
+def list_users() -> Response:
+    '''Returns a page of users, ordered by id.'''
+    fields = requested_fields(USER_FIELDS)
+    after = request.args.get('after', type=int)
+    stamps, cursor = keyset_page(
+        User.query.with_entities(User.id, User.updated_at),
+        [User.id], None if after is None else (after,),
+        current_app.config['USER_PAGE_SIZE'])
+    etag = make_etag(fields, stamps)
+    if (response := not_modified(etag)): return response
+    users = fetch_ordered(User, [row.id for row in stamps], fields)
+    return json_response({'items': [serialize(user, fields) for user in users],
+                          'next': cursor[0] if cursor else None}, etag)
+
+@blueprint.route('/users/<int:user_id>')
+@login_required
+def get_user(user_id:int) -> Response:
+    '''Returns a single user's public profile.'''
+    fields = requested_fields(USER_FIELDS)
+    stamp = User.query.with_entities(User.id, User.updated_at)\
+        .filter(User.id == user_id).first_or_404()
+    etag = make_etag(fields, [stamp])
+    if (response := not_modified(etag)): return response
+    user = fetch_ordered(User, [user_id], fields)[0]
+    return json_response(serialize(user, fields), etag)
@@ -7,15 +7,44 @@ Authentication routes for qqueue. Includes:
 Note that unlike most routes, these do not need to be prefixed.
 '''
 
+import math
 from flask import Blueprint, Response, request, render_template, flash, current_app, redirect, url_for, abort
 from flask_login import login_user, login_required, current_user, logout_user
-from werkzeug.security import generate_password_hash, check_password_hash
 from qqueue.forms import RegisterForm, LoginForm, CredentialsForm
+from qqueue.passwords import HashQueueFull, hash_password, check_password, needs_rehash
 from qqueue.models import User
-from qqueue.extensions import database, w3, endpoint_exception, display_user
+from qqueue.routes.users import invalidate_user_count
+from qqueue.extensions import database, identities, endpoint_exception, display_user
+from qqueue.addresses import is_address
+from qqueue.throttle import buckets
 
 blueprint = Blueprint('auth', __name__)
 
+@blueprint.app_errorhandler(HashQueueFull)
+def hash_queue_full(_:HashQueueFull) -> Response:
+    '''Sheds load when the password hashing pool is backed up.'''
+    current_app.logger.warning(f'503: password hash queue full: {request.path}')
+    response = Response('Too many sign-in requests right now. Please try again.',
+                        status=503, mimetype='text/plain')
+    response.headers['Retry-After'] = '1'
+    return response
+
+def login_throttled(user:User|None, email_or_username:str) -> float:
+    '''
+    Spends a login attempt from both the caller's address and the target
+    account's buckets. Returns 0 if allowed, otherwise seconds until retry.
+    Known accounts are keyed by id, so their email and username share one
+    bucket.
+    '''
+    config = current_app.config
+    by_address = buckets.take(f'login:ip:{request.remote_addr}',
+                              config['LOGIN_IP_BURST'], config['LOGIN_IP_RATE'])
+    if by_address: return by_address # don't let one address lock out others
+    account = f'id:{user.id}' if user else email_or_username
+    return buckets.take(f'login:account:{account}',
+                        config['LOGIN_ACCOUNT_BURST'],
+                        config['LOGIN_ACCOUNT_RATE'])
+
 @blueprint.route('/register', methods=('GET', 'POST'))
 def register() -> Response:
     '''Handles new user registrations.'''
@@ -36,14 +65,15 @@ def register() -> Response:
             elif len(User.query.filter_by(email=email).all()) > 0:
                 flash('Email already registered.')
                 errors = True
-            elif not w3.is_address(address):
+            elif not is_address(address):
                 flash('Address must be a valid blockchain address.')
                 errors = True
             if not errors and form.validate_on_submit():
-                password = generate_password_hash(password=password)
+                password = hash_password(password)
                 user = User(email=email, username=username, password=password, address=address)
                 database.session.add(user)
                 database.session.commit()
+                invalidate_user_count()
                 message = f'User "{user.username}" ({user.email}) registered successfully.'
                 current_app.logger.info(msg=message)
                 flash(message)
@@ -62,15 +92,27 @@ def login() -> Response:
         case 'POST':
             email_or_username = form.email_or_username.data.strip().lower()
             password = form.password.data.strip()
-            errors = False
             user = User.query.filter(database.or_(
                 User.email == email_or_username,
                 User.username == email_or_username
             )).first()
-            if not user or not check_password_hash(user.password, password):
+            # checked before the password so throttled guesses cost no hashing
+            retry_after = login_throttled(user, email_or_username)
+            if retry_after:
+                current_app.logger.warning(f'429: login throttled: {request.remote_addr} -> {email_or_username}') # pylint: disable=line-too-long
+                flash('Too many login attempts. Please try again later.')
+                response = current_app.make_response(
+                    (render_template('auth/login.html', form=form), 429))
+                response.headers['Retry-After'] = str(math.ceil(retry_after))
+                return response
+            errors = False
+            if not user or not check_password(user.password, password):
                 flash('Invalid user credentials. Please try again.')
                 errors = True
             if not errors and form.validate_on_submit():
+                if needs_rehash(user.password): # hash settings changed
+                    user.password = hash_password(password)
+                    database.session.commit()
                 login_user(user, remember=True)
                 message = f'User "{user.username}" ({user.email}) logged in successfully.'
                 current_app.logger.info(msg=message)
@@ -99,7 +141,7 @@ def edit() -> Response:
             current_password = form.current_password.data.strip() # never None
             address = (form.address.data or '').strip().lower()
             errors = False
-            if not check_password_hash(user.password, current_password):
+            if not check_password(user.password, current_password):
                 flash('Current password is incorrect.')
                 errors = True
             elif password != confirm_password:
@@ -109,15 +151,16 @@ def edit() -> Response:
                     int(user.email == email): # change = false = 0 = no matches
                 flash('Email already registered to another user.')
                 errors = True
-            elif address and not w3.is_address(address):
+            elif address and not is_address(address):
                 flash('Address must be a valid blockchain address.')
                 errors = True
             if not errors and form.validate_on_submit():
                 user.email = email
-                if password: user.password = generate_password_hash(password)
+                if password: user.password = hash_password(password)
                 if address: user.address = address
                 database.session.add(user)
                 database.session.commit()
+                identities.delete(user.id)
                 flash(f'Credentials for {user.username} updated successfully.')
                 return redirect(url_for('users.get_user', user_id=user.id))
             return render_template('auth/edit.html',
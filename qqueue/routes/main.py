@@ -1,15 +1,53 @@
 '''The main set of routes for qqueue.'''
 from datetime import datetime, timezone
-from flask import Blueprint, Response, render_template
+from hashlib import sha1
+from flask import Blueprint, Response, request, session, render_template, make_response, current_app
+from flask_login import current_user
+from qqueue.extensions import cache
+from qqueue.templating import template_version
 
 blueprint = Blueprint('main', __name__)
 
+def static_page(template:str) -> Response:
+    '''
+    Serves `template`, which only varies by who is logged in, from a copy
+    pre-rendered per user, with an `ETag` and `Last-Modified` so repeat
+    visits get a 304. Copies are keyed by the templates' version, so a
+    deploy never serves the old HTML. Pages with flashed messages are rendered fresh and
+    never stored, since each message is only shown once.
+    '''
+    if '_flashes' in session:
+        response = make_response(render_template(template))
+        response.cache_control.no_store = True
+        return response
+    key = ('page', template, template_version(template, 'base.html'),
+           current_user.get_id(),
+           getattr(current_user, 'username', None)) # renames change the nav
+    page = cache.get(key)
+    if page is None:
+        html = render_template(template)
+        page = (sha1(html.encode()).hexdigest(),
+                datetime.now(timezone.utc).replace(microsecond=0), html)
+        cache.set(key, page, ttl=current_app.config['STATIC_PAGE_TTL'])
+    etag, last_modified, html = page
+    response = make_response(html)
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    if current_user.is_authenticated: # the nav names the user
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+    else:
+        response.cache_control.public = True
+        response.cache_control.max_age = current_app.config['STATIC_PAGE_MAX_AGE'] # pylint: disable=line-too-long
+    response.vary.add('Cookie')
+    return response.make_conditional(request)
+
 @blueprint.route('/')
 def index() -> Response:
-    '''Returns the qqueue homepage.'''
-    return render_template('index.html', dt_utc=datetime.now(timezone.utc))
+    '''Returns the qqueue homepage. The clock is filled in client-side.'''
+    return static_page('index.html')
 
 @blueprint.route('/about')
 def about() -> Response:
     '''Returns the about page.'''
-    return render_template('about.html')
+    return static_page('about.html')
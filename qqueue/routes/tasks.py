@@ -1,36 +1,140 @@
 '''
 Task routes for qqueue. Includes:
     /tasks - All tasks that have yet to be accepted in the system
+    /tasks/search - Ranked full-text search over open tasks
+    /tasks/import - Bulk task creation from a CSV/JSONL upload
+    /tasks/export.<format> - Streamed CSV/JSONL history of the current user
+    /tasks/<task_id>/comments - Older pages of a task's comment thread
+
+Also registers `flask tasks import` for bulk imports and `flask tasks
+archive` to move approved tasks out of the live tables.
 '''
-from datetime import date, datetime
-from flask import Blueprint, Response, request, render_template, flash, redirect, url_for, abort, current_app
+import json
+from collections.abc import Iterator
+from datetime import date, timedelta
+from tempfile import SpooledTemporaryFile
+import click
+from flask import Blueprint, Response, request, render_template, flash, redirect, url_for, abort, current_app, stream_with_context
 from flask_login import login_required, current_user
-from qqueue.forms import TaskForm, CommentForm
-from qqueue.models import Task, Comment
-from qqueue.extensions import database, endpoint_exception
+from sqlalchemy.orm import joinedload
+from sqlalchemy.orm.exc import StaleDataError
+from qqueue.forms import TaskForm, CommentForm, ImportForm
+from qqueue.models import User, Task, Comment, ArchivedTask, ArchivedComment
+from qqueue.states import TaskStatus, transition, is_editable
+from qqueue.extensions import database, cache, fragments, endpoint_exception, keyset_page
+from qqueue.search import search_tasks
+from qqueue.imports import FORMATS, TASK_COLUMNS, detect_format, import_tasks
+from qqueue.exports import FORMATS as EXPORT_FORMATS, export_history
+from qqueue.archive import archive_tasks
+from qqueue.counters import adjust, adjust_comments
 
 blueprint = Blueprint('tasks', __name__)
 
+TEASER_CACHE_KEY = 'tasks.teaser'
+TEASER_SIZE = 5
+
+def get_teaser() -> list[str]:
+    '''
+    Returns the summaries of the open tasks due soonest, which is all that
+    logged-out visitors get to see. Cached briefly since this is the bulk of
+    anonymous traffic.
+    '''
+    summaries = cache.get(TEASER_CACHE_KEY)
+    if summaries is None:
+        rows = database.session.query(Task.summary)\
+            .filter(Task.status == TaskStatus.OPEN)\
+            .order_by(Task.due_by, Task.id)\
+            .limit(TEASER_SIZE)
+        summaries = [row.summary for row in rows]
+        cache.set(TEASER_CACHE_KEY, summaries,
+                  ttl=current_app.config['TASK_TEASER_TTL'])
+    return summaries
+
+def invalidate_teaser() -> None:
+    '''Drops the cached teaser after a write that could change it.'''
+    cache.delete(TEASER_CACHE_KEY)
+
+def encode_cursor(cursor:tuple|None) -> str|None:
+    '''Converts a (`due_by`, `id`) keyset cursor into a URL-safe string.'''
+    if cursor is None: return None
+    due_by, task_id = cursor
+    return f'{due_by.isoformat()}_{task_id}'
+
+def decode_cursor(value:str|None) -> tuple|None:
+    '''
+    Inverse of `encode_cursor`. Malformed values are treated as missing so a
+    bad link just falls back to the first page.
+    '''
+    if not value: return None
+    try:
+        due_by, task_id = value.split('_')
+        return date.fromisoformat(due_by), int(task_id)
+    except ValueError:
+        return None
+
+def apply_transition(task_id:int, action:str):
+    '''
+    Runs `action` on task `task_id` for `current_user` through the state
+    machine and commits it. Aborts with 403 if the task wasn't in the right
+    state (or the user isn't allowed), or 404 if it doesn't exist.
+    '''
+    row = transition(task_id, action, current_user.id)
+    if row is None:
+        database.session.rollback()
+        if database.session.get(Task, task_id) is None: abort(404)
+        abort(403)
+    database.session.commit()
+    fragments.invalidate('task', task_id)
+    return row
+
+@blueprint.app_errorhandler(StaleDataError)
+def stale_task(_:StaleDataError) -> Response:
+    '''Refuses an edit to a task that changed after it was loaded.'''
+    database.session.rollback()
+    current_app.logger.warning(f'409: stale write: {request.path}')
+    return Response('This task was changed by someone else. Reload and try again.', # pylint: disable=line-too-long
+                    status=409, mimetype='text/plain')
+
 @blueprint.route('/')
 def index() -> Response:
+    '''
+    Returns the task board. Each section is its own keyset-paginated query,
+    with a "load more" cursor passed back via `<section>_after`.
+    '''
     data = dict()
     if current_user.is_authenticated:
-        tasks = Task.query.filter(Task.completed_at == None).order_by(Task.due_by).all()
-        data['requested_tasks'] = []
-        data['accepted_tasks'] = []
-        data['open_tasks'] = []
-        for task in tasks:
-            if task.accepted_at is None:
-                data['open_tasks'].append(task)
-            elif task.accepted_by == current_user.id:
-                data['accepted_tasks'].append(task)
-            elif task.requested_by == current_user.id:
-                data['requested_tasks'].append(task)
+        keys = [Task.due_by, Task.id]
+        limit = current_app.config['TASK_PAGE_SIZE']
+        with_requester = joinedload(Task.requester) # shown on each card
+        sections = {
+            'open': Task.query.filter(Task.status == TaskStatus.OPEN)
+                .options(with_requester),
+            'accepted': Task.query.filter(Task.status == TaskStatus.ACCEPTED,
+                                          Task.accepted_by == current_user.id)
+                .options(with_requester),
+            'requested': Task.query.filter(Task.status == TaskStatus.ACCEPTED,
+                                           Task.requested_by == current_user.id),
+        }
+        for section, query in sections.items():
+            after = decode_cursor(request.args.get(f'{section}_after'))
+            tasks, cursor = keyset_page(query, keys, after, limit)
+            data[f'{section}_tasks'] = tasks
+            data[f'{section}_more'] = encode_cursor(cursor)
     else:
-        tasks = Task.query.filter(Task.accepted_at == None).order_by(Task.due_by).all()
-        data['summaries'] = [task.summary for task in tasks[:5]]
+        data['summaries'] = get_teaser()
     return render_template('tasks/index.html', **data)
 
+@blueprint.route('/search')
+@login_required
+def search() -> Response:
+    '''Returns a page of open tasks matching the `q` query parameter.'''
+    query = request.args.get('q', '').strip()
+    page = max(request.args.get('page', 1, type=int), 1)
+    tasks, has_more = search_tasks(query, page,
+                                   current_app.config['TASK_PAGE_SIZE'])
+    return render_template('tasks/search.html', query=query, page=page,
+                           tasks=tasks, has_more=has_more)
+
 @blueprint.route('/new', methods=('GET', 'POST'))
 @login_required
 def new_task() -> Response:
@@ -57,7 +161,9 @@ def new_task() -> Response:
                             due_by=due_by,
                             requested_by=current_user.id)
                 database.session.add(task)
+                adjust(current_user.id, request_count=1, open_count=1)
                 database.session.commit()
+                invalidate_teaser()
                 message = f'Task "{summary}" added successfully.'
                 current_app.logger.info(msg=message)
                 flash(message=message)
@@ -66,18 +172,172 @@ def new_task() -> Response:
         case _:
             endpoint_exception()
 
+@blueprint.route('/import', methods=('GET', 'POST'))
+@login_required
+def import_task_file() -> Response:
+    '''
+    Creates a task for each valid row of an uploaded CSV/JSONL file. The
+    response is a JSON lines report: one per rejected row, then a summary.
+    '''
+    form = ImportForm()
+    columns = ', '.join(TASK_COLUMNS)
+    match request.method:
+        case 'GET':
+            return render_template('tasks/import.html', form=form,
+                                   columns=columns)
+        case 'POST':
+            upload = form.file.data
+            file_format = request.form.get('format') or \
+                detect_format(getattr(upload, 'filename', None) or '')
+            if not form.validate_on_submit() or file_format not in FORMATS:
+                flash('Upload a .csv or .jsonl file to import.')
+                return render_template('tasks/import.html', form=form,
+                                       columns=columns), 400
+            # run the whole import now, rather than while streaming, so it
+            # finishes even if the client goes away; the report is spooled to
+            # disk past 1MB so a file full of bad rows can't eat memory
+            report = SpooledTemporaryFile(max_size=2**20, mode='w+')
+            for line in report_lines(import_tasks(
+                    upload.stream, file_format, current_user.id,
+                    current_app.config['IMPORT_BATCH_SIZE'])):
+                report.write(line)
+            report.seek(0)
+            return Response(stream_report(report),
+                            mimetype='application/x-ndjson')
+        case _:
+            endpoint_exception()
+
+def report_lines(report) -> Iterator[str]:
+    '''Serializes import report entries as JSON lines.'''
+    for entry in report:
+        if 'imported' in entry: invalidate_teaser()
+        yield json.dumps(entry) + '\n'
+
+def stream_report(report:SpooledTemporaryFile) -> Iterator[str]:
+    '''Streams a spooled report back to the client, then discards it.'''
+    with report:
+        yield from report
+
+@blueprint.route('/export.<file_format>')
+@login_required
+def export_tasks(file_format:str) -> Response:
+    '''
+    Streams every task the current user requested or accepted, with their
+    comments, as CSV or JSONL. Rows come off a server-side cursor, so memory
+    use doesn't grow with the length of the history.
+    '''
+    if file_format not in EXPORT_FORMATS: abort(404)
+    mimetype = 'text/csv' if file_format == 'csv' else 'application/x-ndjson'
+    rows = export_history(current_user.id, file_format,
+                          current_app.config['EXPORT_BATCH_SIZE'])
+    response = Response(stream_with_context(rows), mimetype=mimetype)
+    response.headers['Content-Disposition'] =\
+        f'attachment; filename=qqueue-tasks.{file_format}'
+    return response
+
+@blueprint.cli.command('import')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--requested-by', required=True,
+              help='Email or username of the requesting user.')
+@click.option('--format', 'file_format', type=click.Choice(FORMATS),
+              help='File format; detected from the extension if omitted.')
+@click.option('--batch-size', type=int,
+              help='Rows per transaction (default IMPORT_BATCH_SIZE).')
+def import_command(path:str, requested_by:str, file_format:str|None,
+                   batch_size:int|None) -> None:
+    '''Bulk imports tasks from a CSV or JSONL file.'''
+    login = requested_by.strip().lower()
+    user = User.query.filter(database.or_(User.email == login,
+                                          User.username == login)).first()
+    if not user: raise click.BadParameter(f'No user "{requested_by}".')
+    file_format = file_format or detect_format(path)
+    if not file_format: raise click.BadParameter('Cannot detect format.')
+    with open(path, 'rb') as stream:
+        for line in report_lines(import_tasks(
+                stream, file_format, user.id,
+                batch_size or current_app.config['IMPORT_BATCH_SIZE'])):
+            click.echo(line, nl=False)
+
+@blueprint.cli.command('archive')
+@click.option('--days', type=int,
+              help='Only tasks approved this long ago (default ARCHIVE_AFTER_DAYS).') # pylint: disable=line-too-long
+@click.option('--batch-size', type=int,
+              help='Tasks per transaction (default ARCHIVE_BATCH_SIZE).')
+def archive_command(days:int|None, batch_size:int|None) -> None:
+    '''Moves approved tasks and their comments into the archive tables.'''
+    config = current_app.config
+    if days is None: days = config['ARCHIVE_AFTER_DAYS']
+    moved = archive_tasks(timedelta(days=days),
+                          batch_size or config['ARCHIVE_BATCH_SIZE'])
+    click.echo(f'Archived {moved} task(s).')
+
+def find_task(task_id:int, with_users:bool=False) -> tuple:
+    '''
+    Returns (task, comment model) for `task_id`, checking the live tables
+    before the archive, optionally joined with its requester and provider.
+    Aborts with 404 if neither has it.
+    '''
+    for model, comment_model in [(Task, Comment),
+                                 (ArchivedTask, ArchivedComment)]:
+        query = model.query.filter(model.id == task_id)
+        if with_users:
+            query = query.options(joinedload(model.requester),
+                                  joinedload(model.provider))
+        task = query.first()
+        if task: return task, comment_model
+    abort(404)
+
+def comment_page(task, comment_model, before:int|None) -> tuple[list, int|None]: # pylint: disable=line-too-long
+    '''Returns a newest-first page of comments on `task`, plus the next cursor.'''
+    query = comment_model.query.options(joinedload(comment_model.user))\
+        .filter(comment_model.task_id == task.id)
+    comments, cursor = keyset_page(query, [comment_model.id],
+                                   None if before is None else (before,),
+                                   current_app.config['COMMENT_PAGE_SIZE'],
+                                   descending=True)
+    return comments, cursor[0] if cursor else None
+
+def can_view(task) -> bool:
+    '''Once accepted, only the requester and provider may view a task.'''
+    return not task.accepted_by or\
+        current_user.id in [task.accepted_by, task.requested_by]
+
 @blueprint.route('/<int:task_id>')
 @login_required
 def get_task(task_id:int) -> Response:
     '''Fetches the task matching `task_id`, if it exists.'''
-    task = Task.query.filter(Task.id == task_id).first_or_404()
-    if task.accepted_by and current_user.id not in [task.accepted_by, task.requested_by]: # pylint disable=line-too-long
+    # 1 query for the task + both users, 1 for a page of comments + authors;
+    # approved tasks may have been archived, so look there second
+    task, comment_model = find_task(task_id, with_users=True)
+    if not can_view(task):
         return redirect(url_for('tasks.index'))
+    before = request.args.get('comments_before', type=int)
+    comments, more = comment_page(task, comment_model, before)
     return render_template('tasks/task.html',
                            task=task,
+                           comments=comments,
+                           comments_more=more,
+                           archived=isinstance(task, ArchivedTask),
                            hide_requester=(current_user.id == task.requested_by),
                            form=CommentForm())
 
+@blueprint.route('/<int:task_id>/comments')
+@login_required
+def list_comments(task_id:int) -> Response:
+    '''
+    Returns an HTML fragment with the page of comments older than `before`,
+    which the task page appends in place when "Load older" is clicked.
+    '''
+    task, comment_model = find_task(task_id)
+    if not can_view(task): abort(403)
+    comments, more = comment_page(task, comment_model,
+                                  request.args.get('before', type=int))
+    return render_template('tasks/comments.html',
+                           task=task,
+                           comments=comments,
+                           comments_more=more,
+                           archived=isinstance(task, ArchivedTask))
+
 @blueprint.route('/<int:task_id>/edit', methods=('GET', 'POST'))
 @login_required
 def edit_task(task_id:int) -> Response:
@@ -87,7 +347,7 @@ def edit_task(task_id:int) -> Response:
     if not task: 
         should_redirect = True
         code = 403
-    elif task.accepted_by or current_user.id != task.requested_by:
+    elif not is_editable(task) or current_user.id != task.requested_by:
         should_redirect = True
         code = 302
     if should_redirect:
@@ -114,6 +374,8 @@ def edit_task(task_id:int) -> Response:
                 task.due_by=due_by
                 database.session.add(task)
                 database.session.commit()
+                invalidate_teaser()
+                fragments.invalidate('task', task.id)
                 message = f'Task "{summary}" updated successfully.'
                 current_app.logger.info(msg=message)
                 flash(message=message)
@@ -127,10 +389,13 @@ def edit_task(task_id:int) -> Response:
 def delete_task(task_id:int) -> Response:
     '''Deletes the task matching `task_id`, if it exists.'''
     task = database.session.get(Task, task_id)
-    if task.accepted_at or current_user.id != task.requested_by: abort(403)
+    if not is_editable(task) or current_user.id != task.requested_by: abort(403)
     summary = task.summary
     database.session.delete(task)
+    adjust(task.requested_by, request_count=-1, open_count=-1)
     database.session.commit()
+    invalidate_teaser()
+    fragments.invalidate('task', task_id)
     flash(f'Task "{summary}" was permanently deleted.')
     return redirect(url_for('tasks.index'))
 
@@ -138,11 +403,8 @@ def delete_task(task_id:int) -> Response:
 @login_required
 def accept_task(task_id:int) -> Response:
     '''Allows `current_user` to claim an unclaimed task.'''
-    task = database.session.get(Task, task_id)
-    if task.accepted_at or current_user.id == task.requested_by: abort(403)
-    task.accepted_at = datetime.now()
-    task.accepted_by = current_user.id
-    database.session.commit()
+    task = apply_transition(task_id, 'accept')
+    invalidate_teaser()
     flash(f'You\'ve accepted "{task.summary}", due date: {task.due_by}.')
     return redirect(url_for('tasks.get_task', task_id=task.id))
 
@@ -150,11 +412,8 @@ def accept_task(task_id:int) -> Response:
 @login_required
 def release_task(task_id:int) -> Response:
     '''Allows `current_user` to release their claim on a task.'''
-    task = database.session.get(Task, task_id)
-    if task.completed_at or current_user.id != task.accepted_by: abort(403)
-    task.accepted_at = None
-    task.accepted_by = None
-    database.session.commit()
+    task = apply_transition(task_id, 'release')
+    invalidate_teaser()
     flash(f'Task "{task.summary}" released. Do not re-claim unless you can complete it.') # pylint: disable=line-too-long
     return redirect(url_for('tasks.get_task', task_id=task.id))
 
@@ -162,10 +421,7 @@ def release_task(task_id:int) -> Response:
 @login_required
 def complete_task(task_id:int) -> Response:
     '''Allows the user matching `accepted_by` to mark a task complete.'''
-    task = database.session.get(Task, task_id)
-    if task.completed_at or current_user.id != task.accepted_by: abort(403)
-    task.completed_at = datetime.now()
-    database.session.commit()
+    task = apply_transition(task_id, 'complete')
     flash(f'Task "{task.summary}" marked as complete. Waiting on requester approval.') # pylint: disable=line-too-long
     return redirect(url_for('tasks.get_task', task_id=task.id))
 
@@ -173,10 +429,7 @@ def complete_task(task_id:int) -> Response:
 @login_required
 def approve_task(task_id:int) -> Response:
     '''Allows the requester to confirm a task is complete.'''
-    task = database.session.get(Task, task_id)
-    if task.approved_at or current_user.id != task.requested_by: abort(403)
-    task.approved_at = datetime.now()
-    database.session.commit()
+    task = apply_transition(task_id, 'approve')
     flash(f'Task "{task.summary}" approved. Payment to provider pending.')
     return redirect(url_for('tasks.get_task', task_id=task.id))
 
@@ -184,10 +437,7 @@ def approve_task(task_id:int) -> Response:
 @login_required
 def reject_task(task_id:int) -> Response:
     '''Allows the requester to deny a task is complete, then re-open it.'''
-    task = database.session.get(Task, task_id)
-    if task.approved_at or current_user.id != task.requested_by: abort(403)
-    task.completed_at = None
-    database.session.commit()
+    task = apply_transition(task_id, 'reject')
     flash(f'Task "{task.summary}" rejected. Please leave a comment explaining why.') # pylint: disable=line-too-long
     return redirect(url_for('tasks.get_task', task_id=task.id))
 
@@ -196,7 +446,8 @@ def reject_task(task_id:int) -> Response:
 def new_comment(task_id:int) -> Response:
     '''Leaves a new comment on a task.'''
     task = database.session.get(Task, task_id)
-    if task.accepted_at is not None and\
+    if task is None: abort(404) # including archived tasks, which are read-only
+    if task.status != TaskStatus.OPEN and\
         current_user.id not in [task.accepted_by, task.requested_by]:
             abort(403)
     form = CommentForm()
@@ -206,6 +457,7 @@ def new_comment(task_id:int) -> Response:
                           created_by=current_user.id,
                           text=text)
         database.session.add(comment)
+        adjust_comments(task_id, 1)
         database.session.commit()
         message = f'{comment.user.username} left a new comment.'
         current_app.logger.info(msg=message)
@@ -238,6 +490,7 @@ def delete_comment(comment_id:int) -> Response:
     comment = database.session.get(Comment, comment_id)
     if not comment or current_user.id != comment.created_by: abort(403)
     database.session.delete(comment)
+    adjust_comments(comment.task_id, -1)
     database.session.commit()
     message = f'Comment #{comment.id} permanently deleted.'
     current_app.logger.info(msg=message)
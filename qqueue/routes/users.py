@@ -3,43 +3,103 @@ User routes for qqueue. Includes:
     /users - A list of all users, if the current user is logged in
     /users/<user_id> - Public profile page for a specific user
     /users/edit - Allows the current user to edit their own profile
+
+Also registers `flask users repair-counters` to recompute the denormalized
+user and task counters.
 '''
 
-from flask import Blueprint, Response, request, render_template, flash, redirect, url_for
+import click
+from flask import Blueprint, Response, request, render_template, flash, redirect, url_for, current_app
 from flask_login import login_required, current_user
-from werkzeug.security import generate_password_hash, check_password_hash
+from sqlalchemy import func
+from sqlalchemy.orm import joinedload
 from qqueue.forms import UserForm, CredentialsForm
-from qqueue.models import User
-from qqueue.extensions import database, endpoint_exception, display_user
+from qqueue.passwords import hash_password, check_password
+from qqueue.models import User, Task
+from qqueue.states import TaskStatus
+from qqueue.counters import repair_counters
+from qqueue.extensions import database, identities, cache, fragments, endpoint_exception, display_user, keyset_page
+from qqueue.routes.tasks import encode_cursor, decode_cursor
 
 blueprint = Blueprint('users', __name__)
 
+USER_COUNT_CACHE_KEY = 'users.count'
+
+def get_user_count() -> int:
+    '''Returns the number of registered users, cached briefly.'''
+    user_count = cache.get(USER_COUNT_CACHE_KEY)
+    if user_count is None:
+        user_count = database.session.query(func.count(User.id)).scalar()
+        cache.set(USER_COUNT_CACHE_KEY, user_count,
+                  ttl=current_app.config['USER_COUNT_TTL'])
+    return user_count
+
+def invalidate_user_count() -> None:
+    '''Drops the cached user count after a registration.'''
+    cache.delete(USER_COUNT_CACHE_KEY)
+
 @blueprint.route('/')
 def index() -> Response:
+    '''
+    Returns the user directory, one keyset page at a time, or just a head
+    count for logged-out visitors. Only the columns shown on each card are
+    loaded, so long bios never leave the database here.
+    '''
     data = dict()
-    users = User.query.all()
     if current_user.is_authenticated:
-        data['users'] = [display_user(user) for user in users]
+        query = database.session.query(User.id, User.username,
+                                       User.headline, User.created_at,
+                                       User.updated_at, User.open_count,
+                                       User.active_count)
+        after = request.args.get('after', type=int)
+        users, cursor = keyset_page(query, [User.id],
+                                    None if after is None else (after,),
+                                    current_app.config['USER_PAGE_SIZE'])
+        data['users'] = users
+        data['more'] = cursor[0] if cursor else None
     else:
-        data['user_count'] = len(users)
+        data['user_count'] = get_user_count()
     return render_template('users/index.html', **data)
 
+@blueprint.cli.command('repair-counters')
+def repair_counters_command() -> None:
+    '''Recomputes every user's task counters and every task's comment count.'''
+    repair_counters()
+    database.session.commit()
+    click.echo('Counters repaired.')
+
 @blueprint.route('/<int:user_id>')
 def get_user(user_id:int) -> Response:
+    '''
+    Returns the profile for `user_id`. Task lists are filtered and paginated
+    in SQL (and skipped when the user's counters say they're empty), and
+    logged-out visitors only see what the counters say.
+    '''
     data = dict()
-    user = database.session.get(User, user_id)
+    user = database.get_or_404(User, user_id)
     if current_user.is_authenticated:
+        keys = [Task.due_by, Task.id]
+        limit = current_app.config['TASK_PAGE_SIZE']
+        sections = {
+            'requests': user.requests.filter(Task.status == TaskStatus.OPEN),
+            'orders': user.orders.filter(
+                database.or_(Task.requested_by == current_user.id,
+                             Task.accepted_by == current_user.id),
+                Task.status.in_([TaskStatus.OPEN, TaskStatus.ACCEPTED]))
+                .options(joinedload(Task.requester)), # shown on each card
+        }
         data['user'] = display_user(user)
-        data['requests'] = [request for request in user.requests
-                            if request.accepted_at == None]
-        data['orders'] = [order for order in user.orders
-                          if (order.requested_by == current_user.id or
-                           order.accepted_by == current_user.id) and
-                           order.completed_at == None]
+        counts = {'requests': user.open_count, 'orders': user.active_count}
+        for section, query in sections.items():
+            after = decode_cursor(request.args.get(f'{section}_after'))
+            tasks, cursor = keyset_page(query, keys, after, limit)\
+                if counts[section] else ([], None)
+            data[section] = tasks
+            data[f'{section}_more'] = encode_cursor(cursor)
     else:
         data['username'] = user.username
-        data['has_requests'] = len(user.requests) > 0
-        data['has_orders'] = len(user.orders) > 0
+        data['has_requests'] = user.request_count > 0
+        data['has_orders'] = user.order_count > 0
     return render_template('users/user.html', **data)
 
 @blueprint.route('/edit', methods=('GET', 'POST'))
@@ -68,6 +128,8 @@ def edit_user() -> Response:
                 user.bio = bio
                 database.session.add(user)
                 database.session.commit()
+                identities.delete(user.id)
+                fragments.invalidate('user', user.id)
                 flash(f'User info for {username} updated successfully.')
                 return redirect(url_for('users.get_user', user_id=user.id))
             return render_template('users/edit.html',
@@ -94,7 +156,7 @@ def edit_credentials() -> Response:
             current_password = form.current_password.data.strip() # never None
             address = form.address.data.strip().lower()
             errors = False
-            if not check_password_hash(user.password, current_password):
+            if not check_password(user.password, current_password):
                 flash('Current password is incorrect.')
                 errors = True
             elif password != confirm_password:
@@ -109,10 +171,11 @@ def edit_credentials() -> Response:
                 errors = True
             if not errors and form.validate_on_submit():
                 user.email = email
-                if password: user.password = generate_password_hash(password)
+                if password: user.password = hash_password(password)
                 if address: user.address = address
                 database.session.add(user)
                 database.session.commit()
+                identities.delete(user.id)
                 flash(f'Credentials for {user.username} updated successfully.')
                 return redirect(url_for('users.get_user', user_id=user.id))
             return render_template('users/credentials.html',
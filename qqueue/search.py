@@ -0,0 +1,91 @@
+'''
+Full-text search over task summaries and details.
+
+On SQLite, tasks are indexed by an external-content FTS5 table (`task_fts`)
+kept in sync with `task` by triggers, so every insert, update and delete is
+reflected without any help from the routes. Other engines fall back to a
+(slower) LIKE scan ranked by how many search terms hit the summary.
+'''
+
+import re
+from sqlalchemy import DDL, Connection, case, event, text
+from sqlalchemy.orm import joinedload
+from qqueue.extensions import database
+from qqueue.models import Task
+from qqueue.states import TaskStatus
+
+FTS_DDL = [
+    '''CREATE VIRTUAL TABLE IF NOT EXISTS task_fts USING fts5(
+           summary, detail, content='task', content_rowid='id')''',
+    '''CREATE TRIGGER IF NOT EXISTS task_fts_insert AFTER INSERT ON task BEGIN
+           INSERT INTO task_fts(rowid, summary, detail)
+           VALUES (new.id, new.summary, new.detail);
+       END''',
+    '''CREATE TRIGGER IF NOT EXISTS task_fts_delete AFTER DELETE ON task BEGIN
+           INSERT INTO task_fts(task_fts, rowid, summary, detail)
+           VALUES ('delete', old.id, old.summary, old.detail);
+       END''',
+    '''CREATE TRIGGER IF NOT EXISTS task_fts_update
+       AFTER UPDATE OF summary, detail ON task BEGIN
+           INSERT INTO task_fts(task_fts, rowid, summary, detail)
+           VALUES ('delete', old.id, old.summary, old.detail);
+           INSERT INTO task_fts(rowid, summary, detail)
+           VALUES (new.id, new.summary, new.detail);
+       END''',
+]
+
+# keep the index alongside the table whenever create_all()/drop_all() run
+for statement in FTS_DDL:
+    event.listen(Task.__table__, 'after_create',
+                 DDL(statement).execute_if(dialect='sqlite'))
+event.listen(Task.__table__, 'before_drop',
+             DDL('DROP TABLE IF EXISTS task_fts').execute_if(dialect='sqlite'))
+
+def create_search_index(connection:Connection) -> None:
+    '''Builds the FTS index for an existing database and fills it.'''
+    if connection.dialect.name != 'sqlite': return
+    for statement in FTS_DDL:
+        connection.execute(text(statement))
+    connection.execute(text("INSERT INTO task_fts(task_fts) VALUES ('rebuild')"))
+
+def search_terms(query:str) -> list[str]:
+    '''Splits free text into words, dropping any search syntax characters.'''
+    return re.findall(r'\w+', query.lower())
+
+def search_tasks(query:str, page:int, per_page:int) -> tuple[list[Task], bool]:
+    '''
+    Returns the open tasks on page `page` (1-based) of the ranked results for
+    `query`, plus whether another page follows.
+    '''
+    terms = search_terms(query)
+    if not terms or page < 1: return [], False
+    if database.engine.dialect.name == 'sqlite':
+        tasks = search_tasks_fts(terms, per_page + 1, (page - 1) * per_page)
+    else:
+        tasks = search_tasks_like(terms, per_page + 1, (page - 1) * per_page)
+    return tasks[:per_page], len(tasks) > per_page
+
+def search_tasks_fts(terms:list[str], limit:int, offset:int) -> list[Task]:
+    '''FTS5 search; every term must match, and summary hits rank highest.'''
+    match = ' '.join(f'"{term}"*' for term in terms) # prefix match each word
+    ids = database.session.execute(text('''
+        SELECT task.id FROM task_fts JOIN task ON task.id = task_fts.rowid
+        WHERE task_fts MATCH :match AND task.status = 'open'
+        ORDER BY bm25(task_fts, 10.0, 1.0), task.due_by, task.id
+        LIMIT :limit OFFSET :offset
+    '''), {'match': match, 'limit': limit, 'offset': offset}).scalars().all()
+    tasks = {task.id: task for task in Task.query.filter(Task.id.in_(ids))
+             .options(joinedload(Task.requester))} # shown on each card
+    return [tasks[task_id] for task_id in ids]
+
+def search_tasks_like(terms:list[str], limit:int, offset:int) -> list[Task]:
+    '''Portable fallback; every term must appear in the summary or detail.'''
+    summary_hits = sum(case((Task.summary.ilike(f'%{term}%'), 1), else_=0)
+                       for term in terms)
+    return Task.query.filter(
+        Task.status == TaskStatus.OPEN,
+        *[database.or_(Task.summary.ilike(f'%{term}%'),
+                       Task.detail.ilike(f'%{term}%')) for term in terms],
+    ).order_by(summary_hits.desc(), Task.due_by, Task.id)\
+     .options(joinedload(Task.requester))\
+     .limit(limit).offset(offset).all()
@@ -0,0 +1,95 @@
+'''
+The task state machine for qqueue.
+
+Each task stores its `status` explicitly so board queries can filter on a
+single indexed column. The lifecycle timestamps (`accepted_at` etc.) are
+still recorded, but only as history; `status` is the source of truth.
+
+    open --accept--> accepted --complete--> completed --approve--> approved
+     ^                 |   ^                    |
+     +----release------+   +-------reject-------+
+
+Every status change goes through `transition`, which applies it with one
+conditional UPDATE that only matches while the task is still in the expected
+state and the user is allowed to make the move, then adjusts both users'
+task counters in the same transaction.
+'''
+
+import enum
+from datetime import datetime
+from sqlalchemy import update, Row
+from qqueue.extensions import database
+
+class TaskStatus(enum.Enum):
+    '''Where a task is in its lifecycle.'''
+    OPEN = 'open'
+    ACCEPTED = 'accepted'
+    COMPLETED = 'completed'
+    APPROVED = 'approved'
+
+
+# action: (required status, resulting status)
+TRANSITIONS = {
+    'accept': (TaskStatus.OPEN, TaskStatus.ACCEPTED),
+    'release': (TaskStatus.ACCEPTED, TaskStatus.OPEN),
+    'complete': (TaskStatus.ACCEPTED, TaskStatus.COMPLETED),
+    'approve': (TaskStatus.COMPLETED, TaskStatus.APPROVED),
+    'reject': (TaskStatus.COMPLETED, TaskStatus.ACCEPTED),
+}
+
+def infer_status(accepted_at=None, completed_at=None, approved_at=None,
+                 **_) -> TaskStatus:
+    '''Works out a status from lifecycle timestamps, e.g. for old rows.'''
+    if approved_at is not None: return TaskStatus.APPROVED
+    if completed_at is not None: return TaskStatus.COMPLETED
+    if accepted_at is not None: return TaskStatus.ACCEPTED
+    return TaskStatus.OPEN
+
+def initial_status(context) -> str:
+    '''Column default: the status implied by the row's timestamps.'''
+    return infer_status(**context.get_current_parameters()).value
+
+def is_editable(task) -> bool:
+    '''Requests can only be edited or deleted until someone accepts them.'''
+    return task.status == TaskStatus.OPEN
+
+def transition(task_id:int, action:str, user_id:int) -> Row|None:
+    '''
+    Applies `action` to task `task_id` on behalf of `user_id`, bumps its row
+    version and adjusts both users' counters, without committing. Returns
+    the task's (id, summary, due_by, requested_by, accepted_by), or `None`
+    if the task isn't in the right state or the user isn't allowed to
+    perform `action` on it.
+    '''
+    from qqueue.models import Task # models imports this module; pylint: disable=import-outside-toplevel
+    from qqueue.counters import TRANSITION_DELTAS, adjust # pylint: disable=import-outside-toplevel
+    source, target = TRANSITIONS[action]
+    now = datetime.now()
+    match action:
+        case 'accept':
+            allowed = Task.requested_by != user_id
+            values = {'accepted_at': now, 'accepted_by': user_id}
+        case 'release':
+            allowed = Task.accepted_by == user_id
+            values = {'accepted_at': None, 'accepted_by': None}
+        case 'complete':
+            allowed = Task.accepted_by == user_id
+            values = {'completed_at': now}
+        case 'approve':
+            allowed = Task.requested_by == user_id
+            values = {'approved_at': now}
+        case 'reject':
+            allowed = Task.requested_by == user_id
+            values = {'completed_at': None, 'rejected_at': now}
+    row = database.session.execute(
+        update(Task)
+        .where(Task.id == task_id, Task.status == source, allowed)
+        .values(**values, status=target, version=Task.version + 1)
+        .returning(Task.id, Task.summary, Task.due_by, Task.requested_by,
+                   Task.accepted_by)
+    ).first()
+    if row is not None:
+        requester, provider = TRANSITION_DELTAS[action]
+        adjust(row.requested_by, **requester)
+        adjust(row.accepted_by or user_id, **provider) # None after release
+    return row
@@ -0,0 +1,122 @@
+'''
+Template compilation for qqueue.
+
+Jinja compiles each template to Python the first time it's rendered, so a
+fresh worker is slow for its first visitors. `configure_templates` stores
+the compiled bytecode under `TEMPLATE_CACHE_DIR`, shared by every worker
+and kept across restarts (entries are checked against the template source,
+so edits are picked up), and with `TEMPLATE_WARMUP` loads every template
+while the app starts instead of on first use.
+
+`template_version` fingerprints template sources, so HTML cached from them
+can be told apart from HTML rendered by a later deploy.
+
+`benchmark_startup` (run via `flask templates benchmark`) times app startup
+and the first render of a few pages under each setup.
+'''
+
+import json
+import os
+import tempfile
+from hashlib import sha1
+from statistics import median
+from time import perf_counter
+import click
+from flask import Flask, current_app
+from flask.cli import AppGroup
+from jinja2 import FileSystemBytecodeCache
+from qqueue.config import SQLITE_PREFIX
+
+BENCHMARK_PATHS = ['/', '/about', '/auth/login', '/auth/register', '/tasks/']
+
+cli = AppGroup('templates', help='Template compilation tools.')
+
+def configure_templates(app:Flask) -> None:
+    '''
+    Enables the bytecode cache, then warms the templates if configured.
+    Also registers the `flask templates` commands.
+    '''
+    app.cli.add_command(cli)
+    directory = app.config['TEMPLATE_CACHE_DIR']
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(directory)
+    if app.config['TEMPLATE_WARMUP']:
+        app.logger.info(f'Compiled {warm_templates(app)} templates.')
+
+def template_version(*names:str) -> str:
+    '''
+    Returns a short fingerprint of the source of templates `names`. It's
+    worked out once per app, since templates only change with a deploy.
+    '''
+    versions = current_app.extensions.setdefault('template_versions', {})
+    if names not in versions:
+        digest = sha1()
+        for name in names:
+            source, _, _ = current_app.jinja_env.loader.get_source(
+                current_app.jinja_env, name)
+            digest.update(source.encode())
+        versions[names] = digest.hexdigest()[:12]
+    return versions[names]
+
+def warm_templates(app:Flask) -> int:
+    '''Loads (compiling if needed) every template. Returns how many.'''
+    names = app.jinja_env.list_templates()
+    for name in names:
+        app.jinja_env.get_template(name)
+    return len(names)
+
+def benchmark_startup(config:type, rounds:int=5) -> dict[str, dict]:
+    '''
+    Starts `rounds` apps from `config` for each template setup (no caching,
+    bytecode cache, bytecode cache plus warm-up) against a scratch database,
+    and returns the median seconds spent in `create_app` and serving the
+    first request to each of `BENCHMARK_PATHS`.
+    '''
+    from qqueue import create_app # qqueue imports this module; pylint: disable=import-outside-toplevel
+    results = {}
+    with tempfile.TemporaryDirectory() as scratch:
+        bytecode_dir = os.path.join(scratch, 'bytecode')
+        setups = {
+            'cold': {'TEMPLATE_CACHE_DIR': None, 'TEMPLATE_WARMUP': False},
+            'bytecode': {'TEMPLATE_CACHE_DIR': bytecode_dir,
+                         'TEMPLATE_WARMUP': False},
+            'warmup': {'TEMPLATE_CACHE_DIR': bytecode_dir,
+                       'TEMPLATE_WARMUP': True},
+        }
+        for setup, settings in setups.items():
+            class BenchmarkConfig(config): # pylint: disable=too-few-public-methods,line-too-long
+                '''Runs apart from any live database, cache or throttle.'''
+                SQLALCHEMY_DATABASE_URI = SQLITE_PREFIX + os.path.join(scratch, 'benchmark.db') # pylint: disable=line-too-long
+                THROTTLE_DATABASE = os.path.join(scratch, 'throttle.db')
+                CACHE_BACKEND = 'memory'
+                FRAGMENT_CACHE_BACKEND = 'memory'
+                TESTING = True # rebuilds the scratch database
+            for name, value in settings.items():
+                setattr(BenchmarkConfig, name, value)
+            if setup == 'bytecode': # fill the cache once, as a deploy would
+                warm_templates(create_app(BenchmarkConfig))
+            startups, firsts = [], []
+            for _ in range(rounds):
+                started = perf_counter()
+                app = create_app(BenchmarkConfig)
+                startups.append(perf_counter() - started)
+                client = app.test_client()
+                started = perf_counter()
+                for path in BENCHMARK_PATHS:
+                    client.get(path)
+                firsts.append(perf_counter() - started)
+            results[setup] = {'startup': median(startups),
+                              'first_requests': median(firsts)}
+    return results
+
+@cli.command('benchmark')
+@click.option('--rounds', type=int, default=5, show_default=True,
+              help='App starts timed per setup.')
+def benchmark_command(rounds:int) -> None:
+    '''Times startup and first requests under each template cache setup.'''
+    config = type('CurrentConfig', (), dict(current_app.config))
+    for setup, timings in benchmark_startup(config, rounds).items():
+        click.echo(json.dumps({'setup': setup, **{
+            name: round(seconds * 1000, 1) # ms
+            for name, seconds in timings.items()}}))
@@ -0,0 +1,82 @@
+'''
+Token-bucket rate limiting shared by every worker process on a host.
+
+Buckets live in a small standalone SQLite file (`THROTTLE_DATABASE`) rather
+than the main database, so throttling never contends with application
+writes. Each `take` refills the bucket for the time since it was last used,
+then spends one token, inside a single `BEGIN IMMEDIATE` transaction so two
+workers can't spend the same token.
+'''
+
+import os
+import sqlite3
+import threading
+from time import time
+from flask import Flask
+
+class TokenBuckets():
+    '''Shared token buckets keyed by arbitrary strings.'''
+    PRUNE_EVERY = 1000 # takes between sweeps of idle buckets
+
+    def __init__(self):
+        self.path = None
+        self.max_idle = 3600
+        self._local = threading.local()
+        self._takes = 0
+
+    def init_app(self, app:Flask) -> None:
+        '''Creates the bucket table (emptied on test) in `THROTTLE_DATABASE`.'''
+        self.path = app.config['THROTTLE_DATABASE']
+        self.max_idle = app.config['THROTTLE_MAX_IDLE']
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        connection = self.connect()
+        connection.execute('''CREATE TABLE IF NOT EXISTS bucket (
+            key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL
+        )''')
+        if app.testing: connection.execute('DELETE FROM bucket')
+
+    def connect(self) -> sqlite3.Connection:
+        '''Returns this thread's connection to the bucket database.'''
+        cached = getattr(self._local, 'connection', None)
+        if cached is None or cached[0] != self.path:
+            connection = sqlite3.connect(self.path, timeout=5,
+                                         isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            self._local.connection = cached = (self.path, connection)
+        return cached[1]
+
+    def take(self, key:str, burst:int, rate:float) -> float:
+        '''
+        Spends a token from bucket `key`, which holds up to `burst` tokens and
+        refills at `rate` tokens per second. Returns 0 on success, otherwise
+        the number of seconds until a token will be available.
+        '''
+        connection = self.connect()
+        now = time()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            row = connection.execute(
+                'SELECT tokens, updated_at FROM bucket WHERE key = ?', (key,)
+            ).fetchone()
+            tokens = burst if row is None else\
+                min(burst, row[0] + (now - row[1]) * rate)
+            wait = 0.0
+            if tokens >= 1: tokens -= 1
+            else: wait = (1 - tokens) / rate
+            connection.execute('''
+                INSERT INTO bucket (key, tokens, updated_at) VALUES (?, ?, ?)
+                ON CONFLICT (key) DO UPDATE
+                SET tokens = excluded.tokens, updated_at = excluded.updated_at
+            ''', (key, tokens, now))
+            self._takes += 1
+            if self._takes % self.PRUNE_EVERY == 0: # forget idle buckets
+                connection.execute('DELETE FROM bucket WHERE updated_at < ?',
+                                   (now - self.max_idle,))
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        return wait
+
+
+buckets = TokenBuckets()
@@ -10,6 +10,7 @@ from qqueue import create_app
 from qqueue.models import User, Task, Comment
 from qqueue.config import TestConfig
 from qqueue.extensions import database
+from qqueue.counters import repair_counters
 
 # initialized outside of the app fixture so the other test modules can access.
 # it's not "best practice" to do this, but it makes writing tests much easier.
@@ -102,6 +103,8 @@ def application() -> Flask: # pyright: ignore[reportInvalidTypeForm]
         database.session.add_all(test_tasks)
         database.session.add_all(test_comments)
         database.session.commit()
+        repair_counters() # seeded directly, so the counters start at 0
+        database.session.commit()
 
         # yielded in app context so downstream fixtures/tests have access to it
         # https://testdriven.io/blog/flask-contexts/#testing-example
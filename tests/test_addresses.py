@@ -0,0 +1,38 @@
+'''Tests for the blockchain address validation of qqueue.'''
+
+from qqueue.addresses import keccak256, to_checksum_address, is_address
+
+# https://eips.ethereum.org/EIPS/eip-55#test-cases
+CHECKSUMMED = [
+    '0x5aAeb6053F3E94C9b9A09f33669435E7Ef1BeAed',
+    '0xfB6916095ca1df60bB79Ce92cE3Ea74c37c5d359',
+    '0xdbF03B407c01E7cD3CBea99509d93f8DDDC8C6FB',
+    '0xD1220A0cf47c7B9Be7A2E6BA89F429762e7b9aDb',
+]
+
+def test_keccak256() -> None:
+    assert keccak256(b'').hex() ==\
+        'c5d2460186f7233c927e7db2dcc703c0e500b653ca82273b7bfad8045d85a470'
+    assert keccak256(b'abc').hex() ==\
+        '4e03657aea45a94fc7d47ba826c8d667c0d1e6e33a64a036ec44f58fa12d6c45'
+    # inputs either side of the 136 byte block size
+    assert len({keccak256(b'q' * n) for n in [135, 136, 137]}) == 3
+
+def test_checksum() -> None:
+    for address in CHECKSUMMED:
+        assert to_checksum_address(address.lower()) == address
+        assert to_checksum_address(address.upper().replace('0X', '0x')) == address # pylint: disable=line-too-long
+
+def test_is_address() -> None:
+    for address in CHECKSUMMED:
+        assert is_address(address)
+        assert is_address(address.lower())
+        assert is_address(address.lower()[2:]) # prefix is optional
+        # flipping the case of any letter breaks the checksum
+        i = max(i for i, char in enumerate(address) if char in 'abcdefABCDEF')
+        broken = address[:i] + address[i].swapcase() + address[i+1:]
+        assert not is_address(broken)
+    assert not is_address('0x' + 'g' * 40)
+    assert not is_address('0x' + 'a' * 39)
+    assert not is_address('0x' + 'a' * 40 + '\n') # $ would allow this
+    assert not is_address(None)
@@ -0,0 +1,98 @@
+'''Tests for the JSON API endpoints of qqueue.'''
+
+from flask.testing import FlaskClient
+from tests.conftest import USER_DATA, TASK_DATA, COMMENT_DATA, Task, authenticate_user, database
+
+def test_auth(client:FlaskClient) -> None:
+    '''Logged out clients get a JSON 401 rather than a login redirect.'''
+    for endpoint in ['/api/v1/tasks', '/api/v1/tasks/1', '/api/v1/users',
+                     '/api/v1/users/1', '/api/v1/tasks/1/comments',
+                     '/api/v1/comments/1']:
+        response = client.get(endpoint)
+        assert response.status_code == 401
+        assert response.json['error'] == 'Unauthorized'
+
+def test_tasks(client:FlaskClient) -> None:
+    '''Tests /api/v1/tasks and /api/v1/tasks/<task_id>'''
+
+    # user3 (id:4) only sees open tasks, ordered by due date, over 2 pages
+    client.application.config['TASK_PAGE_SIZE'] = 4
+    authenticate_user(credentials=USER_DATA[3], client=client)
+    open_ids = [i+1 for i, task in enumerate(TASK_DATA)
+                if 'accepted_at' not in task]
+    first = client.get('/api/v1/tasks').json
+    second = client.get('/api/v1/tasks', query_string={'after':first['next']}).json # pylint: disable=line-too-long
+    assert [task['id'] for task in first['items'] + second['items']] == open_ids
+    assert second['next'] is None
+    assert first['items'][0]['summary'] == TASK_DATA[open_ids[0]-1]['summary']
+
+    # Tasks accepted by other users are hidden, even by id
+    assert client.get('/api/v1/tasks/3').status_code == 404
+    assert client.get(f'/api/v1/tasks/{open_ids[0]}').status_code == 200
+
+    # But the parties to a task can see it
+    authenticate_user(credentials=USER_DATA[1], client=client)
+    assert client.get('/api/v1/tasks/3').json['accepted_by'] == 2
+
+def test_sparse_fields(client:FlaskClient) -> None:
+    '''The `fields` parameter limits the keys in each resource.'''
+    authenticate_user(credentials=USER_DATA[3], client=client)
+    task = client.get('/api/v1/tasks/5', query_string={'fields':'summary'}).json
+    assert task == {'id': 5, 'summary': TASK_DATA[4]['summary']}
+    user = client.get('/api/v1/users/4', query_string={'fields':'bio'}).json
+    assert user == {'id': 4, 'bio': USER_DATA[3]['bio']}
+    response = client.get('/api/v1/users', query_string={'fields':'password'})
+    assert response.status_code == 400
+    assert 'password' in response.json['message']
+
+def test_users_never_leak_credentials(client:FlaskClient) -> None:
+    '''Emails, passwords and addresses aren't part of the user resource.'''
+    authenticate_user(credentials=USER_DATA[0], client=client)
+    response = client.get('/api/v1/users')
+    assert [user['username'] for user in response.json['items']] ==\
+        [user['username'] for user in USER_DATA]
+    for user in USER_DATA:
+        for secret in ['email', 'password', 'address']:
+            assert user[secret] not in response.text
+
+def test_comments(client:FlaskClient) -> None:
+    '''Tests /api/v1/tasks/<task_id>/comments and /api/v1/comments/<id>'''
+    authenticate_user(credentials=USER_DATA[3], client=client)
+    task_id = 5
+    texts = [c['text'] for c in COMMENT_DATA if c['task_id'] == task_id]
+    response = client.get(f'/api/v1/tasks/{task_id}/comments')
+    assert [c['text'] for c in response.json['items']] == texts
+    comment_id = response.json['items'][0]['id']
+    assert client.get(f'/api/v1/comments/{comment_id}').json['text'] == texts[0] # pylint: disable=line-too-long
+
+    # Comments on tasks the user can't see are hidden too
+    assert client.get('/api/v1/tasks/3/comments').status_code == 404
+    hidden_id = [i+1 for i, c in enumerate(COMMENT_DATA) if c['task_id'] == 3]
+    assert client.get(f'/api/v1/comments/{hidden_id[0]}').status_code == 404
+
+def test_etags(client:FlaskClient) -> None:
+    '''Unchanged resources answer If-None-Match with an empty 304.'''
+    authenticate_user(credentials=USER_DATA[3], client=client)
+    for endpoint in ['/api/v1/tasks', '/api/v1/tasks/5', '/api/v1/users',
+                     '/api/v1/users/1', '/api/v1/tasks/5/comments']:
+        response = client.get(endpoint)
+        etag = response.headers['ETag']
+        assert not etag.startswith('W/') # strong
+        response = client.get(endpoint, headers={'If-None-Match': etag})
+        assert response.status_code == 304
+        assert response.data == b''
+
+    # A different fieldset is a different representation
+    etag = client.get('/api/v1/tasks/5').headers['ETag']
+    response = client.get('/api/v1/tasks/5', query_string={'fields':'summary'},
+                          headers={'If-None-Match': etag})
+    assert response.status_code == 200
+
+    # Any change to the row produces a new ETag
+    task = database.session.get(Task, 5)
+    task.summary = 'Changed summary'
+    database.session.commit()
+    response = client.get('/api/v1/tasks/5', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.json['summary'] == 'Changed summary'
+    assert response.headers['ETag'] != etag
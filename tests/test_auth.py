@@ -4,7 +4,11 @@ from random import randint
 from secrets import token_hex
 from flask import g #globals
 from flask.testing import FlaskClient
-from tests.conftest import USER_DATA, authenticate_user, assert_redirect
+from tests.conftest import USER_DATA, User, authenticate_user, assert_redirect, database
+from qqueue.passwords import hash_password, check_password, needs_rehash, get_pool, shutdown_pool
+from qqueue.throttle import TokenBuckets
+import qqueue.passwords as passwords
+import qqueue.routes.auth as auth_routes
 
 def test_register(client:FlaskClient) -> None:
     '''Tests the `/register` endpoint of the app.'''
@@ -227,3 +231,116 @@ def test_edit(client:FlaskClient) -> None:
     # But logging in with the old username should be fine
     response = authenticate_user(credentials=final_creds, client=client)
     assert response.status_code == 200
+
+def test_rehash_on_login(client:FlaskClient) -> None:
+    '''Stored hashes are upgraded on login when the hash settings change.'''
+    method = 'pbkdf2:sha256:1000'
+    client.application.config['PASSWORD_HASH_METHOD'] = method
+    user = User.query.filter_by(email=USER_DATA[0]['email']).first()
+    old_hash = user.password
+    assert not old_hash.startswith(method) # sanity check
+    response = authenticate_user(credentials=USER_DATA[0], client=client)
+    assert response.status_code == 200
+    database.session.refresh(user)
+    assert user.password.startswith(f'{method}$')
+
+    # The upgraded hash still works, and isn't rehashed again
+    upgraded_hash = user.password
+    client.get('/auth/logout')
+    response = authenticate_user(credentials=USER_DATA[0], client=client)
+    assert response.status_code == 200
+    database.session.refresh(user)
+    assert user.password == upgraded_hash
+
+    # Short method names match the full form werkzeug stores for them
+    assert user.password.startswith('pbkdf2:sha256:1000$')
+    client.application.config['PASSWORD_HASH_METHOD'] = 'scrypt'
+    assert old_hash.startswith('scrypt:32768:8:1$')
+    assert not needs_rehash(old_hash)
+    assert needs_rehash(user.password)
+
+def test_hash_pool(client:FlaskClient, monkeypatch) -> None:
+    '''Hashing runs on the process pool, and sheds load when it's full.'''
+    exit_handlers = []
+    monkeypatch.setattr(passwords.atexit, 'register', exit_handlers.append)
+    config = client.application.config
+    config['PASSWORD_HASH_WORKERS'] = 1
+    config['PASSWORD_HASH_QUEUE'] = 1
+    config['PASSWORD_HASH_WAIT'] = 0.01
+    try:
+        password_hash = hash_password('pooled')
+        assert check_password(password_hash, 'pooled')
+        assert not check_password(password_hash, 'wrong')
+
+        # With every slot taken, logins get a 503 instead of queueing
+        _, slots = get_pool()
+        slots.acquire()
+        try:
+            response = authenticate_user(credentials=USER_DATA[0], client=client) # pylint: disable=line-too-long
+            assert response.status_code == 503
+            assert response.headers['Retry-After'] == '1'
+        finally:
+            slots.release()
+        response = authenticate_user(credentials=USER_DATA[0], client=client)
+        assert response.status_code == 200
+
+        # Restarting the pool doesn't stack up exit handlers
+        shutdown_pool()
+        assert check_password(hash_password('restarted'), 'restarted')
+        assert not exit_handlers
+    finally:
+        shutdown_pool()
+
+def test_login_throttle(client:FlaskClient, monkeypatch) -> None:
+    '''Logins are throttled per account and per address before hashing.'''
+    config = client.application.config
+    config['LOGIN_ACCOUNT_BURST'] = 2
+    config['LOGIN_ACCOUNT_RATE'] = 0.001
+    wrong = {**USER_DATA[0], 'password': 'wrong'}
+
+    # Attempts within the burst are checked as normal
+    for _ in range(2):
+        response = authenticate_user(credentials=wrong, client=client)
+        assert response.status_code == 400
+
+    # Past it, the account is refused without touching the password hash,
+    # even when the password is correct
+    checks = []
+    monkeypatch.setattr(auth_routes, 'check_password',
+                        lambda *args: checks.append(args) or True)
+    response = authenticate_user(credentials=USER_DATA[0], client=client)
+    assert response.status_code == 429
+    assert int(response.headers['Retry-After']) > 0
+    assert not checks
+
+    # Other accounts from the same address are unaffected
+    monkeypatch.undo()
+    response = authenticate_user(credentials=USER_DATA[1], client=client)
+    assert response.status_code == 200
+    assert response.request.path == '/'
+
+    # The email and username of an account share its bucket
+    by_username = {**USER_DATA[1], 'email': USER_DATA[1]['username'],
+                   'password': 'wrong'}
+    authenticate_user(credentials={**USER_DATA[1], 'password': 'wrong'},
+                      client=client)
+    response = authenticate_user(credentials=by_username, client=client)
+    assert response.status_code == 429
+
+    # Until the address runs out too. Behind the proxy, that's the client's
+    # address from X-Forwarded-For, not the proxy's
+    config['LOGIN_IP_BURST'] = 1
+    config['LOGIN_IP_RATE'] = 0.001
+    client.environ_base['HTTP_X_FORWARDED_FOR'] = '203.0.113.7'
+    authenticate_user(credentials=USER_DATA[2], client=client)
+    response = authenticate_user(credentials=USER_DATA[2], client=client)
+    assert response.status_code == 429
+    client.environ_base['HTTP_X_FORWARDED_FOR'] = '203.0.113.8'
+    response = authenticate_user(credentials=USER_DATA[2], client=client)
+    assert response.status_code == 200
+
+    # Buckets are shared by every store on the same file (i.e. every worker)
+    other_worker = TokenBuckets()
+    other_worker.path = config['THROTTLE_DATABASE']
+    assert other_worker.take('login:account:id:1', 2, 0.001)
+    assert not other_worker.take('login:account:nobody', 2, 0.001)
@@ -0,0 +1,218 @@
+'''Tests for the cache extension and shared backends of qqueue.'''
+
+import socket
+import socketserver
+import threading
+from fnmatch import fnmatchcase
+from pathlib import Path
+from time import sleep, monotonic
+from pytest import fixture, raises
+from flask import Flask
+from flask.testing import FlaskClient
+from qqueue.caching import SQLiteBackend, RedisBackend
+from qqueue.config import TestConfig
+from qqueue.extensions import Cache, TTLCache, cache as app_cache, fragments as card_cache
+from tests.conftest import USER_DATA, authenticate_user
+
+class RedisStandIn(socketserver.ThreadingTCPServer):
+    '''
+    Local stand-in for a Redis server: just the commands `RedisBackend`
+    sends, with expiry, over the real protocol.
+    '''
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        self.entries = {} # name: (expires_at, value)
+        self.clients = []
+        self.garbled = False # answer everything with nonsense
+        super().__init__(('127.0.0.1', 0), RedisStandInHandler)
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+
+    @property
+    def url(self) -> str:
+        '''Where `RedisBackend` can reach the stand-in.'''
+        return f'redis://127.0.0.1:{self.server_address[1]}/0'
+
+    def stop(self) -> None:
+        '''Stops listening and drops every open connection, like a crash.'''
+        self.shutdown()
+        self.server_close()
+        for client in self.clients:
+            if client.fileno() != -1: client.shutdown(socket.SHUT_RDWR)
+        self.clients.clear()
+
+
+class RedisStandInHandler(socketserver.StreamRequestHandler):
+    '''Answers one client connection of the stand-in.'''
+    def setup(self) -> None:
+        super().setup()
+        self.server.clients.append(self.connection)
+
+    def read_command(self) -> list[bytes]|None:
+        header = self.rfile.readline()
+        if not header: return None
+        args = []
+        for _ in range(int(header[1:])):
+            length = int(self.rfile.readline()[1:])
+            args.append(self.rfile.read(length + 2)[:-2])
+        return args
+
+    def handle(self) -> None:
+        entries = self.server.entries
+        while (args := self.read_command()) is not None:
+            command, args = args[0].upper(), args[1:]
+            for name, (expires_at, _) in list(entries.items()):
+                if expires_at < monotonic(): del entries[name]
+            match command:
+                case b'SELECT' | b'PING':
+                    reply = b'+OK\r\n'
+                case b'GET':
+                    value = entries.get(args[0], (0, None))[1]
+                    reply = b'$-1\r\n' if value is None else\
+                        b'$%d\r\n%s\r\n' % (len(value), value)
+                case b'SET': # SET name value PX milliseconds
+                    entries[args[0]] = (monotonic() + int(args[3]) / 1000,
+                                        args[1])
+                    reply = b'+OK\r\n'
+                case b'DEL':
+                    reply = b':%d\r\n' % sum(entries.pop(name, None) is not None
+                                             for name in args)
+                case b'KEYS':
+                    names = [name for name in entries
+                             if fnmatchcase(name.decode(), args[0].decode())]
+                    reply = b'*%d\r\n' % len(names) + b''.join(
+                        b'$%d\r\n%s\r\n' % (len(name), name) for name in names)
+                case _:
+                    reply = b'-ERR unknown command\r\n'
+            if self.server.garbled: reply = b'?what\r\n'
+            self.wfile.write(reply)
+
+
+@fixture()
+def redis_server() -> RedisStandIn: # pyright: ignore[reportInvalidTypeForm]
+    '''Runs a Redis stand-in for the test.'''
+    server = RedisStandIn()
+    yield server
+    server.stop()
+
+@fixture()
+def redis_url(redis_server:RedisStandIn) -> str: # fixtures, pylint: disable=redefined-outer-name
+    '''Returns the URL of the test's Redis stand-in.'''
+    return redis_server.url
+
+def cache_app(**settings) -> Flask:
+    '''Builds a bare app carrying the cache settings of TestConfig.'''
+    app = Flask(__name__)
+    app.config.from_object(TestConfig)
+    app.config.update(settings)
+    return app
+
+def check_backend(backend) -> None:
+    '''Runs the get/set/delete/expiry contract every backend must meet.'''
+    backend.clear()
+    assert backend.get('missing') is None
+    assert backend.get('missing', 'default') == 'default'
+    backend.set(('task', 1, False), {'html': '<p>card</p>'}, ttl=60)
+    assert backend.get(('task', 1, False)) == {'html': '<p>card</p>'}
+    backend.set(('task', 1, False), 'replaced', ttl=60)
+    assert backend.get(('task', 1, False)) == 'replaced'
+    backend.delete(('task', 1, False))
+    assert backend.get(('task', 1, False)) is None
+    backend.set('brief', 1, ttl=0.05)
+    sleep(0.1)
+    assert backend.get('brief') is None
+    backend.set('kept', 1, ttl=60)
+    backend.clear()
+    assert backend.get('kept') is None
+
+def test_memory_backend() -> None:
+    '''The in-process LRU keeps `max_entries`, counting what it evicts.'''
+    check_backend(TTLCache())
+    backend = TTLCache(max_entries=2)
+    for key in 'abc':
+        backend.set(key, key, ttl=60)
+    assert backend.get('a') is None and backend.get('c') == 'c'
+    assert backend.evictions == 1
+
+def test_sqlite_backend(tmp_path:Path) -> None:
+    '''Workers sharing a file see each other's entries, per namespace.'''
+    path = str(tmp_path / 'cache.db')
+    check_backend(SQLiteBackend(path, 'app'))
+    worker1, worker2 = SQLiteBackend(path, 'app'), SQLiteBackend(path, 'app')
+    worker1.set('teaser', ['Setup 2 laptops'], ttl=60)
+    assert worker2.get('teaser') == ['Setup 2 laptops']
+    assert SQLiteBackend(path, 'fragments').get('teaser') is None
+
+    # Sweeps drop expired entries, then the soonest to expire over the limit
+    worker1.max_entries = 3
+    worker1.set('expired', 1, ttl=-1)
+    for i in range(5):
+        worker1.set(i, i, ttl=60 + i)
+    worker1.prune()
+    assert worker1.evictions == 4 # 'expired', 'teaser', 0 and 1
+    assert [worker2.get(i) for i in range(5)] == [None, None, 2, 3, 4]
+
+def test_redis_backend(redis_server:RedisStandIn, redis_url:str) -> None: # fixtures, pylint: disable=redefined-outer-name
+    '''The Redis-protocol backend namespaces its keys on a shared server.'''
+    check_backend(RedisBackend(redis_url, 'app'))
+    app, fragments = RedisBackend(redis_url, 'app'), RedisBackend(redis_url, 'fragments') # pylint: disable=line-too-long
+    app.set('count', 4, ttl=60)
+    fragments.set('count', 'card', ttl=60)
+    app.clear()
+    assert app.get('count') is None and fragments.get('count') == 'card'
+
+    # A garbled reply drops the connection, since it's out of step now
+    redis_server.garbled = True
+    with raises(ConnectionError):
+        fragments.get('count')
+    redis_server.garbled = False
+    assert fragments.get('count') == 'card'
+
+def test_cache_extension(tmp_path:Path, redis_url:str) -> None: # fixtures, pylint: disable=redefined-outer-name
+    '''Every configured backend serves the same API and stats.'''
+    for backend in ['memory', 'sqlite', 'redis']:
+        cache = Cache('app')
+        cache.init_app(cache_app(CACHE_BACKEND=backend, CACHE_SIZE=1,
+                                 CACHE_SQLITE_PATH=str(tmp_path / 'cache.db'),
+                                 CACHE_REDIS_URL=redis_url))
+        assert cache.get('count') is None
+        cache.set('count', 0, ttl=60) # falsy values are still hits
+        assert cache.get('count', 'default') == 0
+        cache.delete('count')
+        assert cache.get('count') is None
+        assert cache.stats == {'hits': 1, 'misses': 2, 'errors': 0,
+                               'evictions': 0}
+
+    # The memory backend evicts as it goes
+    cache = Cache('app')
+    cache.init_app(cache_app(CACHE_BACKEND='memory', CACHE_SIZE=1))
+    cache.set('a', 1, ttl=60)
+    cache.set('b', 2, ttl=60)
+    assert cache.get('a') is None
+    assert cache.stats == {'hits': 0, 'misses': 1, 'errors': 0, 'evictions': 1}
+
+def test_backend_outage(client:FlaskClient, redis_server:RedisStandIn) -> None: # fixtures, pylint: disable=redefined-outer-name
+    '''Pages still render, uncached, while a shared backend is down.'''
+    client.application.config.update(CACHE_BACKEND='redis',
+                                     FRAGMENT_CACHE_BACKEND='redis',
+                                     CACHE_REDIS_URL=redis_server.url)
+    app_cache.init_app(client.application)
+    card_cache.init_app(client.application)
+    authenticate_user(credentials=USER_DATA[3], client=client)
+    assert client.get('/tasks/').status_code == 200
+    assert card_cache.backend.stats['misses'] and not card_cache.backend.stats['errors'] # pylint: disable=line-too-long
+
+    redis_server.stop()
+    for path in ['/', '/about', '/tasks/', '/users/', '/users/1']:
+        response = client.get(path)
+        assert response.status_code == 200, path
+    assert 'Setup 12 laptops' in client.get('/tasks/').text
+    assert app_cache.stats['errors'] == 1 # then left alone for RETRY_AFTER
+    assert card_cache.backend.stats['errors'] == 1
+
+    # After RETRY_AFTER, the backend is tried again
+    app_cache.down_until = 0
+    assert app_cache.get('teaser') is None
+    assert app_cache.stats['errors'] == 2
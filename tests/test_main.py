@@ -1,12 +1,53 @@
 """Test for the main routes of qqueue."""
 
+import sys
+from pathlib import Path
+from flask import Flask
 from flask.testing import FlaskClient
-from qqueue.extensions import w3
+from qqueue import create_app
+from qqueue.config import TestConfig, SQLITE_PREFIX
+from qqueue.extensions import database, cache, get_w3
+from qqueue.templating import cli as templates_cli, benchmark_startup
+from tests.conftest import USER_DATA, authenticate_user
 
 def test_index(client:FlaskClient) -> None:
     response = client.get('/')
     assert 'The current time is' in response.text
 
+def test_conditional_get(client:FlaskClient) -> None:
+    # the pages are pre-rendered (the clock runs client-side), so they carry
+    # validators and come back 304 while unchanged
+    response = client.get('/')
+    etag, last_modified = response.headers['ETag'], response.headers['Last-Modified'] # pylint: disable=line-too-long
+    assert response.cache_control.public and response.cache_control.max_age
+    assert 'Cookie' in response.vary
+    assert client.get('/').headers['ETag'] == etag
+    assert client.get('/', headers={'If-None-Match': etag}).status_code == 304
+    assert client.get('/', headers={'If-Modified-Since': last_modified}).status_code == 304 # pylint: disable=line-too-long
+    assert client.get('/about', headers={'If-None-Match': etag}).status_code == 200 # pylint: disable=line-too-long
+
+    # a deploy that changes the templates gets a fresh copy
+    for key in list(cache.backend._entries): # pylint: disable=protected-access
+        if key[:2] == ('page', 'index.html'):
+            stored_etag, stored_at, _ = cache.get(key)
+            cache.set(key, (stored_etag, stored_at, 'before the deploy'), ttl=60) # pylint: disable=line-too-long
+    assert client.get('/').text == 'before the deploy'
+    versions = client.application.extensions['template_versions']
+    versions[('index.html', 'base.html')] = 'next-deploy'
+    assert 'The current time is' in client.get('/').text
+
+    # each user gets their own copy, which browsers must revalidate
+    authenticate_user(credentials=USER_DATA[0], client=client)
+    response = client.get('/')
+    assert response.headers['ETag'] != etag
+    assert USER_DATA[0]['username'] in response.text
+    assert response.cache_control.private and response.cache_control.no_cache
+    assert client.get('/', headers={'If-None-Match': response.headers['ETag']}).status_code == 304 # pylint: disable=line-too-long
+
+    # flashed messages are never stored
+    response = client.get('/auth/logout', follow_redirects=True)
+    assert response.cache_control.no_store and 'ETag' not in response.headers
+
 def test_about(client:FlaskClient) -> None:
     response = client.get('/about')
     assert '<a href="https://github.com/whitgroves" target="_blank">whitgroves</a>' in response.text # pylint: disable=line-too-long
@@ -14,4 +55,40 @@ def test_about(client:FlaskClient) -> None:
     assert '<a href="mailto:whitney.groves@gmail.com" target="_blank">whitney.groves@gmail.com</a>' in response.text # pylint: disable=line-too-long
 
 def test_web3(client:FlaskClient) -> None:
-    assert w3.is_connected()
\ No newline at end of file
+    # web3 isn't loaded just to serve pages, only when first asked for
+    client.get('/')
+    assert 'web3' not in sys.modules or get_w3.cache_info().currsize == 0
+    w3 = get_w3()
+    assert w3.is_connected()
+    assert get_w3() is w3
+
+def test_sqlite_pragmas(client:FlaskClient) -> None:
+    # connect-time pragmas from the config apply to every pooled connection
+    pragmas = client.application.config['SQLITE_PRAGMAS']
+    with database.engine.connect() as connection:
+        def pragma(name:str):
+            return connection.exec_driver_sql(f'PRAGMA {name}').scalar()
+        assert pragma('journal_mode') == 'wal'
+        assert pragma('synchronous') == 1 # NORMAL
+        assert pragma('busy_timeout') == pragmas['busy_timeout']
+        assert pragma('cache_size') == pragmas['cache_size']
+
+def test_template_warmup(tmp_path:Path) -> None:
+    # warm-up compiles every template at startup into the bytecode cache
+    class WarmConfig(TestConfig): # pylint: disable=too-few-public-methods
+        SQLALCHEMY_DATABASE_URI = SQLITE_PREFIX + str(tmp_path / 'warm.db')
+        TEMPLATE_CACHE_DIR = str(tmp_path / 'bytecode')
+        TEMPLATE_WARMUP = True
+    app = create_app(WarmConfig)
+    templates = app.jinja_env.list_templates()
+    assert {'base.html', 'index.html', 'macros.html'} <= set(templates)
+    assert len(list((tmp_path / 'bytecode').iterdir())) == len(templates)
+
+def test_template_benchmark(application:Flask) -> None:
+    # timed directly; CLI output is swallowed by pytest's live logging
+    assert application.cli.commands['templates'] is templates_cli
+    assert 'benchmark' in templates_cli.commands
+    timings = benchmark_startup(TestConfig, rounds=1)
+    assert list(timings) == ['cold', 'bytecode', 'warmup']
+    assert all(row['startup'] > 0 and row['first_requests'] > 0
+               for row in timings.values())
@@ -0,0 +1,93 @@
+'''Tests for the versioned schema migrations of qqueue.'''
+
+import sqlite3
+from pathlib import Path
+from sqlalchemy import event, inspect
+from qqueue import create_app
+from qqueue.config import TestConfig, SQLITE_PREFIX
+from qqueue.extensions import database
+from qqueue.migrations import MIGRATIONS, schema_version, upgrade_database
+
+def legacy_config(db_path:Path) -> type:
+    '''Builds a non-testing config (so no rebuild) pointed at `db_path`.'''
+    class LegacyConfig(TestConfig): # pylint: disable=too-few-public-methods
+        SQLALCHEMY_DATABASE_URI = SQLITE_PREFIX + str(db_path)
+        TESTING = False
+    return LegacyConfig
+
+def test_upgrade_preserves_data(tmp_path:Path) -> None:
+    '''An old database gets the new indexes without losing any rows.'''
+
+    # Build a database as the original schema would have, with no indexes
+    db_path = tmp_path / 'legacy.db'
+    connection = sqlite3.connect(db_path)
+    connection.executescript('''
+        CREATE TABLE user (id INTEGER PRIMARY KEY, email VARCHAR(64) NOT NULL UNIQUE,
+            username VARCHAR(32) NOT NULL UNIQUE, password VARCHAR(128) NOT NULL,
+            address VARCHAR(42) NOT NULL, created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            headline VARCHAR(256), bio TEXT);
+        CREATE TABLE task (id INTEGER PRIMARY KEY, summary VARCHAR(256) NOT NULL,
+            detail TEXT NOT NULL, reward_amount FLOAT NOT NULL,
+            reward_currency VARCHAR(16) NOT NULL, due_by DATE NOT NULL,
+            requested_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            requested_by INTEGER NOT NULL REFERENCES user(id),
+            accepted_at DATETIME, accepted_by INTEGER REFERENCES user(id),
+            completed_at DATETIME, approved_at DATETIME, rejected_at DATETIME);
+        INSERT INTO user (email, username, password, address)
+            VALUES ('old@test.net', 'old', 'x', '0x0');
+        INSERT INTO task (summary, detail, reward_amount, reward_currency,
+                          due_by, requested_by)
+            VALUES ('legacy task', 'still here', 1.0, 'USD', '2030-01-01', 1);
+        INSERT INTO task (summary, detail, reward_amount, reward_currency,
+                          due_by, requested_by, accepted_at, accepted_by,
+                          completed_at)
+            VALUES ('done task', 'awaiting approval', 1.0, 'USD', '2030-01-01',
+                    1, '2029-12-01', 1, '2029-12-02');
+    ''') # pylint: disable=line-too-long
+    connection.commit()
+    connection.close()
+
+    app = create_app(legacy_config(db_path))
+    with app.app_context():
+        inspector = inspect(database.engine)
+        assert all(inspector.has_table(name)
+                   for name in ['comment', 'task_archive', 'comment_archive'])
+        task_indexes = {index['name'] for index in inspector.get_indexes('task')} # pylint: disable=line-too-long
+        assert {'ix_task_status_due', 'ix_task_requester_status', 'ix_task_provider_status'} <= task_indexes # pylint: disable=line-too-long
+        comment_indexes = {index['name'] for index in inspector.get_indexes('comment')} # pylint: disable=line-too-long
+        assert {'ix_comment_thread', 'ix_comment_author'} <= comment_indexes
+        statuses = database.session.execute(
+            database.text('SELECT summary, status FROM task ORDER BY id')).all()
+        assert statuses == [('legacy task', 'open'), ('done task', 'completed')]
+        # task was rebuilt so archived ids aren't reused, keeping its triggers
+        objects = dict(database.session.execute(database.text(
+            "SELECT name, sql FROM sqlite_master WHERE tbl_name = 'task'")).all())
+        assert 'AUTOINCREMENT' in objects['task']
+        assert {'task_fts_insert', 'task_fts_delete', 'task_fts_update'} <= set(objects) # pylint: disable=line-too-long
+        version = database.session.execute(
+            database.select(schema_version.c.version)).scalar_one()
+        assert version == len(MIGRATIONS)
+
+def test_new_database_is_current(tmp_path:Path) -> None:
+    '''A brand new database is built from the models and stamped current.'''
+    app = create_app(legacy_config(tmp_path / 'new.db'))
+    with app.app_context():
+        inspector = inspect(database.engine)
+        assert all(inspector.has_table(name)
+                   for name in ['user', 'task', 'comment', 'schema_version'])
+        version = database.session.execute(
+            database.select(schema_version.c.version)).scalar_one()
+        assert version == len(MIGRATIONS)
+
+    # Once current, startup is a single query against schema_version
+    statements = []
+    def record(conn, cursor, statement, *_): # pylint: disable=unused-argument
+        statements.append(statement)
+    with app.app_context():
+        event.listen(database.engine, 'before_cursor_execute', record)
+        try:
+            upgrade_database(app)
+        finally:
+            event.remove(database.engine, 'before_cursor_execute', record) # pylint: disable=line-too-long
+    assert len(statements) == 1
+    assert 'schema_version' in statements[0]
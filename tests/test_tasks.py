@@ -1,11 +1,20 @@
 '''Tests for the task endpoints of qqueue.'''
 
+import csv
+import io
+import json
+from pathlib import Path
 from random import choice, randint
-from flask import g # globals - needed for CSRF token
+from flask import Flask, g # globals - needed for CSRF token
 from flask.testing import FlaskClient
 from tests.conftest import USER_DATA, TASK_DATA, COMMENT_DATA, Task, date, timedelta, authenticate_user, assert_redirect, database
 from qqueue.config import ACCEPTED_CURRENCIES
-from qqueue.models import Comment
+from sqlalchemy import event, update
+from qqueue.models import User, Comment, ArchivedTask, ArchivedComment
+from qqueue.routes.tasks import invalidate_teaser
+from qqueue.states import TaskStatus
+from qqueue.search import search_tasks_like
+from qqueue.extensions import fragments
 
 def test_index(client:FlaskClient) -> None: # pylint: disable=too-many-statements
     '''Tests the endpoint /tasks'''
@@ -87,6 +96,7 @@ def test_index(client:FlaskClient) -> None: # pylint: disable=too-many-statement
     # Now delete *unaccepted* tasks to test scenario where
     # no tasks should be displayed
     Task.query.filter(Task.accepted_at == None).delete(synchronize_session=False) # pylint: disable=line-too-long, singleton-comparison
+    invalidate_teaser() # bulk delete skips the routes, so clear the cache too
 
     # We will use user3 since they are not associated with any tasks
     authenticate_user(credentials=USER_DATA[3], client=client)
@@ -119,6 +129,114 @@ def test_index(client:FlaskClient) -> None: # pylint: disable=too-many-statement
     assert all(text not in response.text for text in logged_in_no_tasks_text)
     assert all(text in response.text for text in logged_out_no_tasks_text)
 
+def test_index_pagination(client:FlaskClient) -> None:
+    '''Tests the "load more" cursors on the endpoint /tasks'''
+
+    # Shrink the page size so the open requests (ids 5-11) span 3 pages
+    client.application.config['TASK_PAGE_SIZE'] = 3
+    authenticate_user(credentials=USER_DATA[3], client=client)
+    open_tasks = [task for task in TASK_DATA if 'accepted_at' not in task]
+    seen = []
+    endpoint = '/tasks/'
+    while endpoint:
+        response = client.get(endpoint)
+        assert response.status_code == 200
+        page = [task['summary'] for task in open_tasks
+                if f'{task["summary"]}</a>' in response.text]
+        assert 0 < len(page) <= 3
+        seen.extend(page)
+        marker = response.text.find('open_after=')
+        endpoint = None
+        if marker > -1:
+            start = response.text.rfind('"', 0, marker) + 1
+            endpoint = response.text[start:response.text.find('"', marker)]
+    # every open task is shown exactly once, in due date order
+    assert seen == [task['summary'] for task in open_tasks]
+
+    # A malformed cursor falls back to the first page
+    response = client.get('/tasks/?open_after=garbage')
+    assert response.status_code == 200
+    assert open_tasks[0]['summary'] in response.text
+
+def test_index_teaser_cache(client:FlaskClient) -> None:
+    '''Tests caching of the logged-out teaser on the endpoint /tasks'''
+
+    # Tasks 0-3 are accepted, so the first open task is index 4 (id:5)
+    endpoint = '/tasks/'
+    first_open, sixth_open = TASK_DATA[4], TASK_DATA[9]
+    response = client.get(endpoint)
+    assert first_open['summary'] in response.text
+    assert sixth_open['summary'] not in response.text
+
+    # Changes made outside the routes aren't seen until the cache is cleared
+    database.session.get(Task, 5).summary = 'Out-of-band edit'
+    database.session.commit()
+    assert first_open['summary'] in client.get(endpoint).text
+    invalidate_teaser()
+    assert 'Out-of-band edit' in client.get(endpoint).text
+
+    # But accepting a task through the route drops it from the teaser at once
+    authenticate_user(credentials=USER_DATA[3], client=client)
+    client.post('/tasks/5/accept')
+    client.get('/auth/logout')
+    response = client.get(endpoint)
+    assert '<p>Out-of-band edit</p>' not in response.text # flash still shows
+    assert sixth_open['summary'] in response.text
+
+def test_search(client:FlaskClient) -> None:
+    '''Tests the endpoint /tasks/search'''
+
+    # Future-proofing
+    endpoint = '/tasks/search'
+    def search(query:str, page:int=1) -> str:
+        response = client.get(endpoint, query_string={'q':query, 'page':page})
+        assert response.status_code == 200
+        return response.text
+
+    # Logged out users are sent to login
+    assert_redirect(client.get(endpoint, query_string={'q':'laptops'}))
+    authenticate_user(credentials=USER_DATA[3], client=client)
+
+    # Only open tasks are searchable; task index 5 (id:6) is Windows 17, while
+    # index 3 (id:4, Windows 15) has been accepted
+    assert TASK_DATA[5]['summary'] in search('windows 17')
+    assert TASK_DATA[3]['summary'] not in search('windows 15')
+    assert 'No open requests match' in search('nonexistent')
+    assert 'No open requests match' in search('"unbalanced AND (')
+
+    # Results are paginated
+    client.application.config['TASK_PAGE_SIZE'] = 4
+    open_tasks = [task for task in TASK_DATA if 'accepted_at' not in task]
+    first, second = search('laptop'), search('laptop', page=2)
+    assert sum(f'{task["summary"]}</a>' in first for task in open_tasks) == 4
+    assert sum(f'{task["summary"]}</a>' in second for task in open_tasks) == 3
+    assert 'page=2' in first and 'page=3' not in second
+
+    # The index follows creates, edits, and deletes
+    authenticate_user(credentials=USER_DATA[0], client=client)
+    new_task = {'csrf_token':g.csrf_token,
+                'summary':'Repaint the flux capacitor',
+                'detail':'Gigawatt-rated paint only',
+                'reward_amount':88.0,
+                'reward_currency':'USD',
+                'due_by':date.today()+timedelta(1)}
+    client.post('/tasks/new', data=new_task)
+    task_id = len(TASK_DATA) + 1
+    assert 'Repaint the flux capacitor' in search('gigawatt')
+    new_task['detail'] = 'Any paint will do'
+    client.post(f'/tasks/{task_id}/edit', data=new_task)
+    assert 'No open requests match' in search('gigawatt')
+    assert 'Repaint the flux capacitor' in search('any paint')
+    client.post(f'/tasks/{task_id}/delete')
+    assert 'No open requests match' in search('flux')
+
+def test_search_fallback(client:FlaskClient) -> None: # pylint: disable=unused-argument
+    '''Tests the LIKE search used on engines without FTS5'''
+    tasks = search_tasks_like(['windows', '17'], limit=10, offset=0)
+    assert [task.summary for task in tasks] == [TASK_DATA[5]['summary']]
+    tasks = search_tasks_like(['laptops'], limit=10, offset=0)
+    assert len(tasks) == len([t for t in TASK_DATA if 'accepted_at' not in t])
+
 def test_new_task(client:FlaskClient) -> None:
     '''Tests the endpoint /tasks/new'''
 
@@ -180,6 +298,113 @@ def test_new_task(client:FlaskClient) -> None:
     assert response.status_code == 400
     assert response.request.path == endpoint
 
+def test_import_tasks(client:FlaskClient) -> None:
+    '''Tests the endpoint /tasks/import'''
+
+    # Future-proofing
+    endpoint = '/tasks/import'
+    due_by = date.today()+timedelta(3)
+    csv_file = '\n'.join([
+        'summary,detail,reward_amount,reward_currency,due_by',
+        f'Imported one,First detail,10,USD,{due_by}',
+        f'Imported two,Second detail,20,NOGOOD,{due_by}',   # bad currency
+        f'Imported three,Third detail,30,EUR,{date.today()-timedelta(1)}', # past # pylint: disable=line-too-long
+        f',No summary,40,USD,{due_by}',                    # missing summary
+        f'Imported five,Fifth detail,50,BTC,{due_by}',
+    ]).encode()
+    def upload(content:bytes, filename:str, **data):
+        return client.post(endpoint, content_type='multipart/form-data',
+                           data={'file': (io.BytesIO(content), filename),
+                                 **data})
+
+    # Logged out users are sent to login
+    assert_redirect(client.get(endpoint))
+
+    # Valid rows are created, invalid rows are reported by line number
+    authenticate_user(credentials=USER_DATA[3], client=client)
+    assert client.get(endpoint).status_code == 200
+    response = upload(csv_file, 'tasks.csv', csrf_token=g.csrf_token)
+    assert response.status_code == 200
+    report = [json.loads(line) for line in response.text.splitlines()]
+    assert [entry['line'] for entry in report[:-1]] == [3, 4, 5]
+    assert 'reward_currency' in report[0]['errors'][0]
+    assert 'Due date cannot be in the past.' in report[1]['errors'][0]
+    assert report[-1] == {'imported': 2, 'rejected': 3}
+    imported = Task.query.filter(Task.summary.like('Imported%')).all()
+    assert sorted(task.summary for task in imported) ==\
+        ['Imported five', 'Imported one']
+    assert all(task.requested_by == 4 for task in imported)
+
+    # JSONL works too, including malformed lines
+    jsonl_file = '\n'.join([
+        json.dumps({'summary':'JSON task', 'detail':'From JSONL',
+                    'reward_amount':5, 'reward_currency':'ETH',
+                    'due_by':str(due_by)}),
+        '{not json',
+        '[1, 2, 3]',
+    ]).encode()
+    response = upload(jsonl_file, 'tasks.jsonl', csrf_token=g.csrf_token)
+    report = [json.loads(line) for line in response.text.splitlines()]
+    assert [entry['line'] for entry in report[:-1]] == [2, 3]
+    assert report[-1] == {'imported': 1, 'rejected': 2}
+
+    # Uploads need a CSRF token and a supported format
+    assert upload(csv_file, 'tasks.csv').status_code == 400
+    assert upload(csv_file, 'tasks.txt', csrf_token=g.csrf_token).status_code == 400 # pylint: disable=line-too-long
+
+def test_import_command(application:Flask, tmp_path:Path) -> None:
+    '''Tests `flask tasks import`'''
+    path = tmp_path / 'tasks.csv'
+    rows = ['summary,detail,reward_amount,reward_currency,due_by']
+    rows += [f'CLI task {i},Detail {i},{i+1},USD,{date.today()}'
+             for i in range(7)]
+    path.write_text('\n'.join(rows))
+    runner = application.test_cli_runner()
+    result = runner.invoke(args=['tasks', 'import', str(path),
+                                 '--requested-by', USER_DATA[3]['username'],
+                                 '--batch-size', '3'])
+    assert result.exit_code == 0
+    assert json.loads(result.output.splitlines()[-1]) ==\
+        {'imported': 7, 'rejected': 0}
+    assert Task.query.filter(Task.summary.like('CLI task%')).count() == 7
+    result = runner.invoke(args=['tasks', 'import', str(path),
+                                 '--requested-by', 'nobody'])
+    assert result.exit_code != 0
+
+def test_export_tasks(client:FlaskClient) -> None:
+    '''Tests the endpoint /tasks/export.<format>'''
+
+    # Logged out users are sent to login
+    assert_redirect(client.get('/tasks/export.csv'))
+
+    # user1 (id:2) only has accepted tasks (ids 2, 3, 4)
+    user_id = 2
+    task_ids = [i+1 for i, task in enumerate(TASK_DATA)
+                if user_id in [task['requested_by'], task.get('accepted_by')]]
+    comments = [c for c in COMMENT_DATA if c['task_id'] in task_ids]
+    authenticate_user(credentials=USER_DATA[user_id-1], client=client)
+
+    # JSONL: one object per task, with its comments nested
+    response = client.get('/tasks/export.jsonl')
+    assert response.status_code == 200
+    assert response.is_streamed
+    assert 'attachment' in response.headers['Content-Disposition']
+    tasks = [json.loads(line) for line in response.text.splitlines()]
+    assert [task['id'] for task in tasks] == task_ids
+    assert [c['text'] for task in tasks for c in task['comments']] ==\
+        [c['text'] for c in comments]
+
+    # CSV: one line per comment, with the task columns repeated
+    client.application.config['EXPORT_BATCH_SIZE'] = 2 # several round-trips
+    response = client.get('/tasks/export.csv')
+    assert response.status_code == 200
+    rows = list(csv.DictReader(io.StringIO(response.text)))
+    assert [row['comment_text'] for row in rows] == [c['text'] for c in comments]
+    assert sorted({int(row['id']) for row in rows}) == task_ids
+
+    # Other formats don't exist
+    assert client.get('/tasks/export.xml').status_code == 404
+
 def test_get_task(client:FlaskClient) -> None: # pylint: disable=too-many-statements
     '''Tests the endpoint /tasks/<task_id>'''
 
@@ -390,6 +615,43 @@ def test_get_task(client:FlaskClient) -> None: # pylint: disable=too-many-statem
     authenticate_user(credentials=USER_DATA[3], client=client)
     assert_redirect(client.get(endpoint), redirect='/tasks')
 
+def test_get_task_query_count(client:FlaskClient) -> None:
+    '''Tests that /tasks/<task_id> doesn't issue a query per comment author'''
+
+    # Future-proofing
+    task_id = len(TASK_DATA) # open task with a single comment
+    endpoint = f'/tasks/{task_id}'
+    authenticate_user(credentials=USER_DATA[3], client=client)
+
+    def count_queries() -> int:
+        '''Counts the SELECTs issued while rendering the task page.'''
+        statements = []
+        def record(conn, cursor, statement, *_): # pylint: disable=unused-argument
+            if statement.lstrip().upper().startswith('SELECT'):
+                statements.append(statement)
+        database.session.expunge_all() # start cold, as a new request would
+        event.listen(database.engine, 'before_cursor_execute', record)
+        try:
+            response = client.get(endpoint)
+        finally:
+            event.remove(database.engine, 'before_cursor_execute', record)
+        assert response.status_code == 200
+        return len(statements)
+
+    baseline = count_queries()
+
+    # Pile on comments from a crowd of new users, none of whom are loaded yet
+    for i in range(10):
+        user = User(email=f'crowd{i}@test.net', username=f'crowd{i}',
+                    password='x', address=f'0x{i:040x}')
+        database.session.add(user)
+        database.session.flush()
+        database.session.add(Comment(task_id=task_id, created_by=user.id,
+                                     text=f'Crowd comment {i}'))
+    database.session.commit()
+
+    assert count_queries() == baseline
+
 def test_edit_task(client:FlaskClient) -> None:
     '''Tests the endpoint /tasks/<task_id>/edit'''
 
@@ -815,3 +1077,207 @@ def test_delete_comment(client:FlaskClient) -> None:
     response = client.post(endpoint, follow_redirects=True)
     assert response.status_code == 200
     assert response.request.path == '/auth/login'
+
+def test_transition_race(client:FlaskClient) -> None:
+    '''Transitions are conditional, so only the first of racing users wins.'''
+
+    # Task id:5 is open, so either provider may claim it
+    task_id = 5
+    version = database.session.get(Task, task_id).version
+    authenticate_user(credentials=USER_DATA[1], client=client)
+    assert_redirect(client.post(f'/tasks/{task_id}/accept'),
+                    redirect=f'/tasks/{task_id}')
+    task = database.session.get(Task, task_id)
+    assert task.accepted_by == 2
+    assert task.version == version + 1
+
+    # The loser of the race gets a 403 and the winner's claim stands
+    authenticate_user(credentials=USER_DATA[3], client=client)
+    assert client.post(f'/tasks/{task_id}/accept').status_code == 403
+    assert database.session.get(Task, task_id).accepted_by == 2
+    assert database.session.get(Task, task_id).version == version + 1
+
+    # Missing tasks are a 404 rather than an error
+    assert client.post('/tasks/9999/accept').status_code == 404
+
+    # An edit based on a stale copy of the task is refused rather than
+    # silently overwriting the other write
+    task_id = 6
+    task = database.session.get(Task, task_id) # loaded, then changed elsewhere
+    database.session.execute(update(Task).where(Task.id == task_id)
+                             .values(version=Task.version + 1)
+                             .execution_options(synchronize_session=False))
+    authenticate_user(credentials=USER_DATA[task.requested_by-1], client=client)
+    response = client.post(f'/tasks/{task_id}/edit', data={
+        'csrf_token': g.csrf_token,
+        'summary': 'Stale edit',
+        'detail': task.detail,
+        'reward_amount': task.reward_amount,
+        'reward_currency': 'USD',
+        'due_by': task.due_by,
+    })
+    assert response.status_code == 409
+    assert database.session.get(Task, task_id).summary != 'Stale edit'
+
+def test_task_status(client:FlaskClient) -> None:
+    '''Statuses follow the state machine, whatever the timestamps say.'''
+
+    # Seeded tasks get the status their timestamps imply
+    expected = {1: TaskStatus.APPROVED, 2: TaskStatus.APPROVED,
+                3: TaskStatus.ACCEPTED, 4: TaskStatus.COMPLETED,
+                5: TaskStatus.OPEN}
+    for task_id, status in expected.items():
+        assert database.session.get(Task, task_id).status == status
+
+    # Work that was never completed can't be approved or rejected
+    authenticate_user(credentials=USER_DATA[0], client=client)
+    for action in ['approve', 'reject']:
+        assert client.post(f'/tasks/3/{action}').status_code == 403
+        assert database.session.get(Task, 3).status == TaskStatus.ACCEPTED
+
+    # Rejecting completed work sends it back to the provider
+    assert_redirect(client.post('/tasks/4/reject'), redirect='/tasks/4')
+    task = database.session.get(Task, 4)
+    assert task.status == TaskStatus.ACCEPTED
+    assert task.completed_at is None and task.rejected_at is not None
+
+def test_archive_tasks(application:Flask, client:FlaskClient) -> None:
+    '''Approved tasks move to the archive but can still be read.'''
+
+    # Tasks 0 and 1 (ids 1, 2) are approved; only they move, one per batch
+    archived_ids = [1, 2]
+    archived_comments = [c['text'] for c in COMMENT_DATA
+                         if c['task_id'] in archived_ids]
+    runner = application.test_cli_runner()
+    result = runner.invoke(args=['tasks', 'archive', '--days', '0',
+                                 '--batch-size', '1'])
+    assert result.exit_code == 0
+    assert result.output.strip() == 'Archived 2 task(s).'
+    assert Task.query.filter(Task.id.in_(archived_ids)).count() == 0
+    assert Comment.query.filter(Comment.task_id.in_(archived_ids)).count() == 0
+    assert [t.id for t in ArchivedTask.query.order_by(ArchivedTask.id)] ==\
+        archived_ids
+    assert sorted(c.text for c in ArchivedComment.query) ==\
+        sorted(archived_comments)
+    assert Task.query.count() == len(TASK_DATA) - len(archived_ids)
+
+    # Nothing is left to move, and recent approvals wait for the cutoff
+    result = runner.invoke(args=['tasks', 'archive', '--days', '0'])
+    assert result.output.strip() == 'Archived 0 task(s).'
+
+    # The task page still works for participants, without comment options
+    authenticate_user(credentials=USER_DATA[0], client=client)
+    response = client.get('/tasks/1')
+    assert response.status_code == 200
+    assert TASK_DATA[0]['summary'] in response.text
+    assert 'I approve the work on task1' in response.text
+    assert 'has been archived' in response.text
+    assert client.post('/tasks/1/comments/new').status_code == 404
+    assert client.get('/tasks/9999').status_code == 404
+
+    # And so do history exports and the API
+    response = client.get('/tasks/export.jsonl')
+    exported = [json.loads(line)['id'] for line in response.text.splitlines()]
+    assert exported == sorted(i+1 for i, task in enumerate(TASK_DATA)
+                              if task['requested_by'] == 1)
+    response = client.get('/api/v1/tasks/1')
+    assert response.status_code == 200
+    assert response.json['status'] == 'approved'
+    response = client.get('/api/v1/tasks/1/comments')
+    assert [c['text'] for c in response.json['items']] ==\
+        [c['text'] for c in COMMENT_DATA if c['task_id'] == 1]
+
+    # Archived ids are never handed out again, even the highest one
+    last = Task.query.order_by(Task.id.desc()).first()
+    last.status = TaskStatus.APPROVED
+    last.approved_at = date.today() - timedelta(days=1)
+    database.session.commit()
+    archived_id = last.id
+    runner.invoke(args=['tasks', 'archive', '--days', '0'])
+    task = Task(**{**TASK_DATA[-1], 'summary': 'New after archive'})
+    database.session.add(task)
+    database.session.commit()
+    assert task.id > archived_id
+
+def test_comment_thread(client:FlaskClient) -> None:
+    '''Comments are paged newest first, with older pages as fragments.'''
+    client.application.config['COMMENT_PAGE_SIZE'] = 3
+    task_id = len(TASK_DATA) # open task with a single comment
+    authenticate_user(credentials=USER_DATA[3], client=client)
+    for i in range(7):
+        client.post(f'/tasks/{task_id}/comments/new',
+                    data={'csrf_token': g.csrf_token, 'text': f'Reply #{i}'})
+    texts = [c['text'] for c in COMMENT_DATA if c['task_id'] == task_id]
+    texts += [f'Reply #{i}' for i in range(7)]
+    assert database.session.get(Task, task_id).comment_count == len(texts)
+
+    # The page shows the count and the newest page, with a link to the rest
+    response = client.get(f'/tasks/{task_id}')
+    assert f'Comments ({len(texts)}):' in response.text
+    assert all(f'> {text}</p>' in response.text for text in texts[-3:])
+    assert all(f'> {text}</p>' not in response.text for text in texts[:-3])
+    assert 'Load older comments' in response.text
+
+    # Older pages come back as bare fragments, each linking to the next
+    pages, before = [], None
+    while True:
+        endpoint = f'/tasks/{task_id}/comments'
+        response = client.get(endpoint, query_string={'before': before} if before else {}) # pylint: disable=line-too-long
+        assert response.status_code == 200
+        assert '<html' not in response.text
+        pages.append([text for text in reversed(texts)
+                      if f'> {text}</p>' in response.text])
+        if 'data-fragment' not in response.text: break
+        before = int(response.text.split('?before=')[1].split('"')[0])
+    assert [text for page in pages for text in page] == list(reversed(texts))
+    assert [len(page) for page in pages] == [3, 3, 2]
+
+    # Deleting a comment updates the count
+    comment = Comment.query.filter_by(task_id=task_id, text='Reply #6').one()
+    client.post(f'/tasks/comments/{comment.id}/delete')
+    assert database.session.get(Task, task_id).comment_count == len(texts) - 1
+
+    # Threads on tasks the user isn't part of stay private
+    assert client.get('/tasks/3/comments').status_code == 403
+
+def test_fragment_cache(client:FlaskClient) -> None:
+    '''Task cards are rendered once per version and dropped on writes.'''
+    task_id = len(TASK_DATA) # open task requested by user0
+    key = ('task', task_id, False)
+    authenticate_user(credentials=USER_DATA[3], client=client)
+    assert 'Setup 12 laptops' in client.get('/tasks/').text
+    stamp, html = fragments.backend.get(key)
+    assert 'Setup 12 laptops' in html
+
+    # Later pages stitch in the stored card
+    fragments.backend.set(key, (stamp, '<p>cached card</p>'), ttl=60)
+    assert '<p>cached card</p>' in client.get('/tasks/').text
+
+    # Cards rendered by an older macros.html (i.e. before a deploy) miss
+    versions = client.application.extensions['template_versions']
+    versions[('macros.html',)] = 'next-deploy'
+    assert '<p>cached card</p>' not in client.get('/tasks/').text
+    fragments.backend.set(key, (fragments.backend.get(key)[0],
+                                '<p>cached card</p>'), ttl=60)
+    assert '<p>cached card</p>' in client.get('/tasks/').text
+
+    # A write from anywhere changes the version, so the card is re-rendered
+    database.session.execute(update(Task).where(Task.id == task_id)
+                             .values(summary='Setup 99 laptops',
+                                     version=Task.version + 1))
+    database.session.commit()
+    response = client.get('/tasks/')
+    assert '<p>cached card</p>' not in response.text
+    assert 'Setup 99 laptops' in response.text
+
+    # The requester's name is part of the card, so renaming them misses too,
+    # even in caches the profile edit never touches
+    fragments.backend.set(key, (fragments.backend.get(key)[0],
+                                '<p>cached card</p>'), ttl=60)
+    authenticate_user(credentials=USER_DATA[0], client=client)
+    client.post('/users/edit', data={'csrf_token': g.csrf_token,
+                                     'username': 'renamed0', 'bio': 'Hi'})
+    response = client.get('/tasks/')
+    assert '<p>cached card</p>' not in response.text
+    assert 'renamed0' in response.text
+    assert 'renamed0' in fragments.backend.get(key)[1]
@@ -3,7 +3,10 @@
 from random import choice, randint
 from flask import g # globals - needed to access CSRF token
 from flask.testing import FlaskClient
-from tests.conftest import USER_DATA, TASK_DATA, authenticate_user, assert_redirect
+from datetime import date
+from flask import Flask
+from tests.conftest import USER_DATA, TASK_DATA, User, authenticate_user, assert_redirect, database
+from qqueue.extensions import identities
 
 def test_index(client:FlaskClient) -> None:
     '''Tests the endpoint `/users`.'''
@@ -34,6 +37,41 @@ def test_index(client:FlaskClient) -> None:
     assert all(user['password'] not in response.text for user in USER_DATA)
     assert 'None' not in response.text
 
+def test_index_pagination(client:FlaskClient) -> None:
+    '''Tests the "load more" cursor and projection on `/users`.'''
+
+    # Shrink the page size so the 4 test users span 2 pages
+    client.application.config['USER_PAGE_SIZE'] = 3
+    authenticate_user(credentials=USER_DATA[0], client=client)
+    response = client.get('/users/')
+    assert response.status_code == 200
+    assert all(user['username'] in response.text for user in USER_DATA[:3])
+    assert 'href="/users/?after=3"' in response.text
+
+    # The last page has the remaining user and no further cursor. The
+    # directory only loads card columns, so bios stay on the profile page.
+    response = client.get('/users/?after=3')
+    assert response.status_code == 200
+    assert USER_DATA[3]['username'] in response.text
+    assert USER_DATA[3]['headline'] in response.text
+    assert USER_DATA[3]['bio'] not in response.text
+    assert all(f'>{user["username"]}</a>' not in response.text
+               for user in USER_DATA[:3])
+    assert 'after=' not in response.text
+
+def test_index_count_cache(client:FlaskClient) -> None:
+    '''Tests that registering invalidates the cached count on `/users`.'''
+    count_text = '{} users are already on qqueue.'
+    assert count_text.format(len(USER_DATA)) in client.get('/users/').text
+    client.get('/auth/register') # generates token
+    client.post('/auth/register', data={'csrf_token': g.csrf_token,
+                                        'email': 'count@test.net',
+                                        'username': 'count',
+                                        'password': 'count',
+                                        'confirm_password': 'count',
+                                        'address': f'0x{"c"*40}'})
+    assert count_text.format(len(USER_DATA)+1) in client.get('/users/').text
+
 def test_get_user(client:FlaskClient) -> None: # pylint: disable=too-many-statements
     '''Tests the endpoint `/users/<user_id>`.'''
 
@@ -154,6 +192,28 @@ def test_get_user(client:FlaskClient) -> None: # pylint: disable=too-many-statem
             continue
         assert task['summary'] not in response.text
 
+def test_get_user_pagination(client:FlaskClient) -> None:
+    '''Tests the "load more" cursor for open requests on `/users/<user_id>`.'''
+
+    # user0 (id:1) has 7 open requests, so a page size of 4 gives 2 pages
+    client.application.config['TASK_PAGE_SIZE'] = 4
+    open_requests = [task['summary'] for task in TASK_DATA
+                     if 'accepted_at' not in task and task['requested_by'] == 1]
+    authenticate_user(credentials=USER_DATA[3], client=client)
+    response = client.get('/users/1')
+    assert response.status_code == 200
+    assert all(f'{summary}</a>' in response.text for summary in open_requests[:4]) # pylint: disable=line-too-long
+    assert all(f'{summary}</a>' not in response.text for summary in open_requests[4:]) # pylint: disable=line-too-long
+    start = response.text.index('href="/users/1?requests_after=') + 6
+    response = client.get(response.text[start:response.text.index('"', start)])
+    assert response.status_code == 200
+    assert all(f'{summary}</a>' not in response.text for summary in open_requests[:4]) # pylint: disable=line-too-long
+    assert all(f'{summary}</a>' in response.text for summary in open_requests[4:]) # pylint: disable=line-too-long
+    assert 'requests_after=' not in response.text
+
+    # Unknown users are a 404 rather than a crash
+    assert client.get(f'/users/{len(USER_DATA)+1}').status_code == 404
+
 def test_edit_user(client:FlaskClient) -> None:
     '''Tests the endpoint `/users/edit`.'''
 
@@ -207,3 +267,79 @@ def test_edit_user(client:FlaskClient) -> None:
     client.get('/auth/logout')
     assert_redirect(client.get(endpoint))
     assert_redirect(client.post(endpoint, data=new_data))
+
+def test_identity_cache(client:FlaskClient) -> None:
+    '''Logged in users are loaded from memory until their profile changes.'''
+    load_user = client.application.login_manager._user_callback # pylint: disable=protected-access
+
+    # The first load queries the database; after that it's served from memory
+    snapshot = load_user('4')
+    assert snapshot.username == USER_DATA[3]['username']
+    assert load_user('4') is snapshot
+    assert load_user(str(len(USER_DATA)+1)) is None
+
+    # Editing the profile drops the cached copy, so the new name shows at once
+    authenticate_user(credentials=USER_DATA[3], client=client)
+    client.post('/users/edit', data={'csrf_token':g.csrf_token,
+                                     'username':'renamed'})
+    assert identities.get(4) is None
+    assert load_user('4').username == 'renamed'
+
+    # As does changing credentials
+    client.post('/auth/edit', data={'csrf_token':g.csrf_token,
+                                    'current_password':USER_DATA[3]['password'],
+                                    'email':'renamed@test.net'})
+    assert identities.get(4) is None
+
+def test_user_counters(application:Flask, client:FlaskClient) -> None:
+    '''Task counters follow every write, and can be rebuilt from scratch.'''
+    def counts(user_id:int) -> dict:
+        user = database.session.get(User, user_id)
+        database.session.refresh(user)
+        return {name: getattr(user, name) for name in
+                ['request_count', 'order_count', 'open_count', 'active_count']}
+    def expected(user_id:int) -> dict:
+        requested = [t for t in TASK_DATA if t['requested_by'] == user_id]
+        ordered = [t for t in TASK_DATA if t.get('accepted_by') == user_id]
+        return {'request_count': len(requested),
+                'order_count': len(ordered),
+                'open_count': len([t for t in requested
+                                   if 'accepted_by' not in t]),
+                'active_count': len([t for t in ordered
+                                     if 'approved_at' not in t])}
+    seeded = {user_id: expected(user_id) for user_id in range(1, 5)}
+    assert all(counts(user_id) == seeded[user_id] for user_id in seeded)
+
+    # Accepting moves the task from the requester's open count to the
+    # provider's active count, and approval retires it from the latter
+    authenticate_user(credentials=USER_DATA[3], client=client)
+    client.post('/tasks/5/accept')
+    client.post('/tasks/5/complete')
+    assert counts(1)['open_count'] == seeded[1]['open_count'] - 1
+    assert counts(4) == {**seeded[4], 'order_count': 1, 'active_count': 1}
+    authenticate_user(credentials=USER_DATA[0], client=client)
+    client.post('/tasks/5/approve')
+    assert counts(4) == {**seeded[4], 'order_count': 1, 'active_count': 0}
+
+    # Creating and deleting requests count too
+    client.get('/tasks/new')
+    response = client.post('/tasks/new', data={
+        'csrf_token': g.csrf_token, 'summary': 'Counted', 'detail': 'Once',
+        'reward_amount': 1, 'reward_currency': 'USD', 'due_by': date.today()})
+    assert counts(1)['request_count'] == seeded[1]['request_count'] + 1
+    client.post(response.location + '/delete')
+    assert counts(1)['request_count'] == seeded[1]['request_count']
+
+    # Logged out profiles read the counters rather than the task table
+    client.get('/auth/logout')
+    response = client.get('/users/4')
+    assert 'This user is already fulfilling orders on qqueue.' in response.text
+
+    # Counters that drift (e.g. from manual edits) can be repaired in bulk
+    database.session.execute(database.update(User).values(open_count=99))
+    database.session.commit()
+    result = application.test_cli_runner().invoke(
+        args=['users', 'repair-counters'])
+    assert result.exit_code == 0
+    assert counts(1) == {**seeded[1], 'open_count': seeded[1]['open_count'] - 1} # pylint: disable=line-too-long
+    assert counts(4) == {**seeded[4], 'order_count': 1, 'active_count': 0}